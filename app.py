@@ -1,8 +1,28 @@
+import logging
+import os
+import time
+from collections import deque
 import streamlit as st
-from openai import OpenAI
-from streamlit_js_eval import streamlit_js_eval
-from urllib.parse import quote
-
+from cards import card_cache_info, display_anime_card
+from catalogue import DEFAULT_CATALOGUE_PATH, Catalogue, recommendation_from_entry
+from clients import build_async_openai_client, build_openai_client
+from context_window import ConversationWindow, count_message_tokens
+from llm_backend import DEFAULT_FAKE_RECORDINGS_PATH, FakeBackend, InstrumentedBackend, OpenAIBackend
+from llm_scheduler import ModelBusyError, RequestScheduler, ScheduledBackend
+from metrics import Metrics, SessionMetrics, serve_prometheus
+from prompts import (RECOMMENDATIONS_MODEL, SECTION_PROMPTS, build_chat_system_prompt, build_recommendations_history,
+                     build_recommendations_messages, recommendations_system_prompt)
+from recommendations import (CARD_SECTIONS, RECOMMENDATIONS_RESPONSE_FORMAT, SECTION_TITLES, Recommendation,
+                             RecommendationPage, RecommendationStreamParser, dump_recommendations,
+                             iter_page_events, parse_recommendations)
+from recommendation_cache import RecommendationCache, make_cache_key
+from section_generation import BackgroundLoop, iter_sections
+from semantic_cache import SemanticCache, personalize_page, profile_fingerprint
+from session_store import SessionStore, new_session_token
+from similarity import SimilarityIndex
+
+
+rerun_started = time.perf_counter()
 
 st.set_page_config(page_title="AnimeVerse Recommendation Bot", page_icon="🌸", layout="wide")
 st.title("AnimeVerse Guide")
@@ -18,143 +38,217 @@ if "chat_complete" not in st.session_state:
     st.session_state.chat_complete = False
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "token_usage" not in st.session_state:
+    # The last few requests' token counts, kept whether or not metrics are enabled
+    st.session_state.token_usage = deque(maxlen=20)
+
+logger = logging.getLogger(__name__)
+
+# Setup answers and progress flags saved with each session
+PERSISTED_FIELDS = ("username", "favorite_anime", "favorite_genres", "experience_level", "content_type",
+                    "content_length", "openai_model", "setup_complete", "user_message_count", "chat_complete",
+                    "recommendations_shown")
+
+# Number of user messages before recommendations are offered
+max_user_messages = st.secrets.get("MAX_USER_MESSAGES", 5)
+
+# Models for the chat and recommendations requests
+chat_model = st.secrets.get("CHAT_MODEL", "gpt-4o")
+recommendations_model = st.secrets.get("RECOMMENDATIONS_MODEL", RECOMMENDATIONS_MODEL)
+
+@st.cache_resource
+def get_openai_client():
+    """Creates the OpenAI client shared by every session on this server"""
+    return build_openai_client(st.secrets["OPEN_API_KEY"], openai_client_settings())
+
+@st.cache_resource
+def get_async_openai_client():
+    """Creates the AsyncOpenAI client used for concurrent section generation"""
+    return build_async_openai_client(st.secrets["OPEN_API_KEY"], openai_client_settings())
+
+def openai_client_settings():
+    """Client settings; retries are left to the request scheduler unless set explicitly"""
+    settings = dict(st.secrets.get("OPENAI_CLIENT", {}))
+    settings.setdefault("max_retries", 0)
+    return settings
+
+@st.cache_resource
+def get_llm_backend():
+    """Creates the LLM backend: "openai" by default, or "fake" to replay recorded completions offline"""
+    if st.secrets.get("LLM_BACKEND", "openai") == "fake":
+        settings = dict(st.secrets.get("FAKE_LLM", {}))
+        recordings_path = settings.pop("recordings_path", DEFAULT_FAKE_RECORDINGS_PATH)
+        return FakeBackend.from_jsonl(recordings_path, **settings)
+    return OpenAIBackend(get_openai_client(), get_async_openai_client())
+
+@st.cache_resource
+def get_request_scheduler():
+    """Creates the scheduler that shares the model quota between every session on this server"""
+    return RequestScheduler(**dict(st.secrets.get("LLM_SCHEDULER", {})))
+
+@st.cache_resource
+def get_background_loop():
+    """Starts the event loop that runs every session's async requests"""
+    return BackgroundLoop()
+
+@st.cache_resource
+def get_catalogue():
+    """Loads the offline anime/manga catalogue once per server"""
+    return Catalogue.load(st.secrets.get("CATALOGUE_PATH", DEFAULT_CATALOGUE_PATH))
+
+@st.cache_resource
+def get_similarity_index():
+    """Loads (or builds and saves) the memory-mapped TF-IDF index over the catalogue"""
+    catalogue_path = st.secrets.get("CATALOGUE_PATH", DEFAULT_CATALOGUE_PATH)
+    return SimilarityIndex.load_or_build(get_catalogue(), os.path.splitext(catalogue_path)[0] + ".tfidf")
+
+@st.cache_resource
+def get_conversation_window():
+    """Creates the token-budgeted context window shared by every session"""
+    return ConversationWindow(
+        token_budget=st.secrets.get("CONTEXT_TOKEN_BUDGET", 3000),
+        summary_tokens=st.secrets.get("CONTEXT_SUMMARY_TOKENS", 400),
+    )
 
-def complete_setup():
-    st.session_state.setup_complete = True
-
-def show_recommendations():
-    st.session_state.recommendations_shown = True
+@st.cache_resource
+def get_recommendation_cache():
+    """Creates the recommendation cache shared by every session on this server"""
+    return RecommendationCache(
+        max_entries=st.secrets.get("RECOMMENDATION_CACHE_SIZE", 256),
+        ttl_seconds=st.secrets.get("RECOMMENDATION_CACHE_TTL", 3600),
+        db_path=st.secrets.get("RECOMMENDATION_CACHE_PATH"),
+    )
 
+@st.cache_resource
+def get_semantic_cache():
+    """Creates the cross-session cache that reuses pages for near-identical profiles"""
+    return SemanticCache(
+        max_entries=st.secrets.get("SEMANTIC_CACHE_SIZE", 512),
+        threshold=st.secrets.get("SEMANTIC_CACHE_THRESHOLD", 0.75),
+        chat_threshold=st.secrets.get("SEMANTIC_CACHE_CHAT_THRESHOLD", 0.5),
+        ttl_seconds=st.secrets.get("SEMANTIC_CACHE_TTL", 24 * 3600),
+        policy=st.secrets.get("SEMANTIC_CACHE_POLICY", "lfu"),
+    )
 
-def get_anime_placeholder(title, genre=None, dimensions="300x450"):
-    """Creates custom anime-themed placeholder images"""
-    
-  
-    genre_colors = {
-        "action": "FF5733/FFFFFF",       # Orange background, white text
-        "adventure": "FF9900/FFFFFF",    # Dark orange background, white text
-        "romance": "FF9EF0/000000",      # Pink background, black text
-        "comedy": "FFEC33/000000",       # Yellow background, black text
-        "horror": "300030/FF0000",       # Dark purple background, red text
-        "fantasy": "33A1FF/FFFFFF",      # Blue background, white text
-        "sci-fi": "33FFB8/000000",       # Teal background, black text
-        "slice of life": "B8FF33/000000", # Light green background, black text
-        "sports": "FF3352/FFFFFF",       # Red background, white text
-        "mecha": "8F8F8F/FFFF00",        # Gray background, yellow text
-        "isekai": "9E33FF/FFFFFF",       # Purple background, white text
-        "mystery": "000066/FFFFFF",      # Dark blue background, white text
-        "psychological": "660066/FFFFFF", # Dark purple background, white text
-        "drama": "006666/FFFFFF",        # Dark teal background, white text
-        "supernatural": "663300/FFFFFF", # Brown background, white text
-        "default": "3357FF/FFFFFF"       # Default blue background, white text
-    }
-    
-  
-    colors = genre_colors.get(genre.lower() if genre else "default", genre_colors["default"])
-    
-  
-    encoded_title = quote(title)
-    
- 
-    placeholder_url = f"https://via.placeholder.com/{dimensions}/{colors}?text={encoded_title}"
-    
-    return placeholder_url
+@st.cache_resource
+def get_metrics():
+    """Creates the metrics registry and, if a port is set, the Prometheus endpoint"""
+    settings = dict(st.secrets.get("METRICS", {}))
+    metrics = Metrics(enabled=settings.get("enabled", False), log_path=settings.get("log_path"))
+    if not metrics.enabled:
+        return metrics
+
+    def cache_gauges():
+        stats = get_recommendation_cache().stats()
+        cards = card_cache_info()
+        return [
+            ("recommendation_cache_hits", {}, stats["hits"]),
+            ("recommendation_cache_misses", {}, stats["misses"]),
+            ("recommendation_cache_hit_rate", {}, stats["hit_rate"]),
+            ("recommendation_cache_entries", {}, stats["entries"]),
+            ("card_cache_hit_rate", {}, cards.hits / ((cards.hits + cards.misses) or 1)),
+            *((f"semantic_cache_{name}", {}, value) for name, value in get_semantic_cache().stats().items()),
+            *((f"llm_scheduler_{name}", {}, value) for name, value in get_request_scheduler().stats().items()),
+        ]
 
-def get_themed_placeholder(title, content_type="anime", genre=None):
-    """Creates placeholders with different layouts based on content type"""
-    
-    encoded_title = quote(title)
-    
-  
-    type_emoji = {
-        "manga": "📚",
-        "movie": "🎬",
-        "light novel": "📘",
-        "anime": "📺"
-    }.get(content_type.lower(), "✨")
-   
-    genre_colors = {
-        "action": "FF5733/FFFFFF",
-        "romance": "FF9EF0/000000",
-        "comedy": "FFEC33/000000",
-        "horror": "300030/FF0000",
-        "fantasy": "33A1FF/FFFFFF",
-        "default": "3357FF/FFFFFF"
-    }
-    colors = genre_colors.get(genre.lower() if genre else "default", genre_colors["default"])
- 
-    dimensions = {
-        "manga": "350x500",
-        "movie": "300x450",
-        "light novel": "250x400",
-        "anime": "300x450"
-    }.get(content_type.lower(), "300x450")
-    
-    
-    return f"https://via.placeholder.com/{dimensions}/{colors}?text={type_emoji}+{encoded_title}"
+    metrics.add_collector(cache_gauges)
+    if settings.get("port"):
+        serve_prometheus(metrics, settings["port"], settings.get("host", "0.0.0.0"))
+    return metrics
+
+@st.cache_resource
+def get_session_store():
+    """Opens the session store shared by every session, or returns None if SESSION_STORE_PATH is empty"""
+    db_path = st.secrets.get("SESSION_STORE_PATH", "sessions.db")
+    if not db_path:
+        return None
+    return SessionStore(db_path, ttl_seconds=st.secrets.get("SESSION_STORE_TTL", 7 * 24 * 3600))
+
+def session_llm_backend(on_wait=None):
+    """Returns the shared LLM backend behind the request scheduler, instrumented when metrics are enabled"""
+    backend = get_llm_backend()
+    if metrics.enabled:
+        backend = InstrumentedBackend(backend, metrics, session_metrics)
+    return ScheduledBackend(backend, get_request_scheduler(), on_wait)
+
+def queue_notice():
+    """Returns an on_wait callback that shows this session's place in the model queue"""
+    placeholder = st.empty()
+
+    def on_wait(position, eta):
+        if position is None:
+            placeholder.empty()
+        elif position:
+            placeholder.info(f"Lots of fans are asking right now. You're #{position} in line, about {eta:.0f}s to go.",
+                             icon="⏳")
+        else:
+            placeholder.info(f"Almost there, waiting about {eta:.0f}s for the guide to catch up.", icon="⏳")
+    return on_wait
+
+# Sessions are keyed by a token in the URL, so a reload, a reconnect or another replica can resume them
+session_store = get_session_store()
+if "session_token" not in st.session_state:
+    session_token = st.query_params.get("session")
+    saved = session_store.load(session_token) if session_store is not None and session_token else None
+    if saved is None:
+        session_token = new_session_token()
+        st.query_params["session"] = session_token
+        st.session_state.persisted_messages = 0
+    else:
+        state, recommendation_events, message_count = saved
+        st.session_state.update(state)
+        st.session_state.persisted_messages = message_count
+        if recommendation_events is not None:
+            # A finished page is replayed as is, so the conversation is not needed again
+            st.session_state.recommendation_events = recommendation_events
+        else:
+            st.session_state.messages = session_store.load_messages(session_token)
+    st.session_state.session_token = session_token
+
+def persist_session():
+    """Saves the setup answers and flags, and appends any messages not stored yet"""
+    if session_store is None:
+        return
+    token = st.session_state.session_token
+    new_messages = st.session_state.messages[st.session_state.persisted_messages:]
+    session_store.save_state(token, {field: st.session_state[field] for field in PERSISTED_FIELDS
+                                     if field in st.session_state})
+    session_store.append_messages(token, st.session_state.persisted_messages, new_messages)
+    st.session_state.persisted_messages += len(new_messages)
+
+def reset_session():
+    """Forgets the current session everywhere and starts a new one"""
+    if session_store is not None:
+        session_store.delete(st.session_state.session_token)
+    st.session_state.clear()
+    st.query_params.clear()
+
+# Instrumentation is a no-op unless enabled under [METRICS]
+metrics = get_metrics()
+if metrics.enabled and "metrics" not in st.session_state:
+    st.session_state.metrics = SessionMetrics()
+session_metrics = st.session_state.get("metrics")
+rerun_phase = ("recommendations" if st.session_state.recommendations_shown
+               else "chat" if st.session_state.setup_complete else "setup")
+
+def record_context_usage(request, usage):
+    """Records the prompt tokens a request sends, the tokens the full history would cost and the turns summarized"""
+    st.session_state.token_usage.append({"request": request, **usage})
+    logger.info("%s request tokens: %s", request, usage)
+    metrics.increment("context_input_tokens_total", usage["input_tokens"], session_metrics, request=request)
+    if "full_tokens" in usage:
+        metrics.increment("context_full_tokens_total", usage["full_tokens"], session_metrics, request=request)
+        metrics.increment("context_summarized_messages_total", usage["summarized_messages"], session_metrics,
+                          request=request)
 
-def create_anime_links(title):
-    """Create formatted links to popular anime databases for a given title"""
-    mal_link = f"https://myanimelist.net/search/all?q={quote(title)}"
-    anilist_link = f"https://anilist.co/search/anime?search={quote(title)}"
-    
-    links_html = f"""
-    <div style="margin-top: 10px; margin-bottom: 10px;">
-        <a href="{mal_link}" target="_blank" style="text-decoration: none; padding: 5px 10px; background-color: #2E51A2; color: white; border-radius: 5px; margin-right: 10px;">
-            MyAnimeList
-        </a>
-        <a href="{anilist_link}" target="_blank" style="text-decoration: none; padding: 5px 10px; background-color: #02A9FF; color: white; border-radius: 5px;">
-            AniList
-        </a>
-    </div>
-    """
-    return links_html
+def complete_setup():
+    st.session_state.setup_complete = True
+    persist_session()
 
-def embed_youtube_trailer(anime_title):
-    """Creates a YouTube search link for an anime trailer"""
-    search_query = f"{anime_title} official trailer"
-    youtube_search = f"https://www.youtube.com/results?search_query={quote(search_query)}"
-    
-    trailer_html = f"""
-    <a href="{youtube_search}" target="_blank" style="text-decoration: none; padding: 5px 10px; background-color: #FF0000; color: white; border-radius: 5px; display: inline-block;">
-        <span style="vertical-align: middle;">▶️ Watch Trailer</span>
-    </a>
-    """
-    return trailer_html
+def show_recommendations():
+    st.session_state.recommendations_shown = True
+    persist_session()
 
-def display_anime_card(title, genre=None, content_type="anime", description="", year=None, appeal=None):
-    """Displays an enhanced anime recommendation card"""
-    
-    # Create columns for card layout
-    col1, col2 = st.columns([1, 2])
-    
-    with col1:
-        # Display the placeholder image based on content type and genre
-        placeholder_url = get_themed_placeholder(title, content_type, genre)
-        st.image(placeholder_url, use_column_width=True)
-    
-    with col2:
-        # Title with year if available
-        if year:
-            st.markdown(f"#### {title} ({year})")
-        else:
-            st.markdown(f"#### {title}")
-        
-        # Genre badge if available
-        if genre:
-            st.markdown(f"**Genre:** {genre.title()}")
-        
-        # Description
-        if description:
-            st.write(description)
-        
-        # Appeal/why they'll like it
-        if appeal:
-            st.markdown(f"**Why you'll enjoy it:** {appeal}")
-        
-        # External links
-        st.markdown(create_anime_links(title), unsafe_allow_html=True)
-        st.markdown(embed_youtube_trailer(title), unsafe_allow_html=True)
 
 # Setup stage for collecting user preferences
 if not st.session_state.setup_complete:
@@ -220,60 +314,86 @@ if st.session_state.setup_complete and not st.session_state.recommendations_show
     icon="✨",
     )
 
-    # Initialize OpenAI client
-    client = OpenAI(api_key=st.secrets["OPEN_API_KEY"])
-
     # Setting OpenAI model if not already initialized
     if "openai_model" not in st.session_state:
-        st.session_state["openai_model"] = "gpt-4o"
+        st.session_state["openai_model"] = chat_model
 
     # Initializing the system prompt for the chatbot
     if not st.session_state.messages:
         st.session_state.messages = [{
             "role": "system",
-            "content": (f"You are AnimeVerse Guide, an enthusiastic and knowledgeable anime and manga recommendation assistant. "
-                        f"You're helping {st.session_state['username']} find new anime and manga to enjoy. "
-                        f"They enjoy {st.session_state['favorite_anime']} and prefer genres like {st.session_state['favorite_genres']}. "
-                        f"Their experience level is {st.session_state['experience_level']}, they're looking for {st.session_state['content_type']}, "
-                        f"and prefer {st.session_state['content_length']} content. "
-                        f"Engage in a friendly conversation about anime and manga, using occasional Japanese terms (with translations), "
-                        f"and references to popular anime. Ask about their preferences to provide personalized recommendations. "
-                        f"Be enthusiastic but not overwhelming. Provide specific recommendations with brief descriptions. "
-                        f"Avoid any inappropriate or adult-only content in your recommendations.")
+            "content": build_chat_system_prompt(st.session_state)
         }]
-
-    # Display chat messages
-    for message in st.session_state.messages:
-        if message["role"] != "system":
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
-
-    # Handle user input and OpenAI response
-    if st.session_state.user_message_count < 5:
-        if prompt := st.chat_input("Your message", max_chars=1000):
+        persist_session()
+
+    # Display chat messages; this only runs on full reruns, new turns are appended by the input fragment
+    chat_history = st.container()
+    with chat_history:
+        for message in st.session_state.messages:
+            if message["role"] != "system":
+                with st.chat_message(message["role"]):
+                    st.markdown(message["content"])
+
+    @st.fragment
+    def chat_turn():
+        """Handles one message; only this fragment reruns when the user sends it"""
+        if st.session_state.user_message_count >= max_user_messages:
+            return
+        prompt = st.chat_input("Your message", max_chars=1000)
+        if not prompt:
+            return
+        with metrics.timer("fragment_run", session_metrics, fragment="chat_turn"):
+            # Elements written to a container outside the fragment accumulate across fragment reruns,
+            # so each turn costs the same however long the conversation is
             st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user"):
-                st.markdown(prompt)
-
-            if st.session_state.user_message_count < 4:
-                with st.chat_message("assistant"):
-                    stream = client.chat.completions.create(
-                        model=st.session_state["openai_model"],
-                        messages=[
-                            {"role": m["role"], "content": m["content"]}
-                            for m in st.session_state.messages
-                        ],
-                        stream=True,
-                    )
-                    response = st.write_stream(stream)
+            # The turn's bubbles share one placeholder so a failed turn can be taken back out of the history
+            turn = chat_history.empty()
+            busy = None
+            with turn.container():
+                with st.chat_message("user"):
+                    st.markdown(prompt)
+
+                if st.session_state.user_message_count < max_user_messages - 1:
+                    # Send the system prompt and recent turns verbatim, older turns as a summary
+                    window_messages, usage = get_conversation_window().build(st.session_state.messages)
+                    record_context_usage("chat", usage)
+                    with st.chat_message("assistant"):
+                        llm_backend = session_llm_backend(queue_notice())
+                        try:
+                            response = st.write_stream(
+                                llm_backend.stream_chat(window_messages, st.session_state["openai_model"])
+                            )
+                        except ModelBusyError as error:
+                            busy = error
+                            response = error.partial_text
+
+            if busy is not None and not response:
+                # Let the user send the message again instead of losing the turn
+                st.session_state.messages.pop()
+                turn.empty()
+                st.warning(f"The guide is swamped right now. Please try again in about "
+                           f"{max(busy.retry_after, 1):.0f}s.")
+                return
+            if busy is not None:
+                # The partial answer is already on screen, so it is kept as this turn's reply
+                st.warning("The guide got cut off mid-answer. Feel free to ask again.")
+            if st.session_state.user_message_count < max_user_messages - 1:
                 st.session_state.messages.append({"role": "assistant", "content": response})
 
             # Increment the user message count
             st.session_state.user_message_count += 1
+            persist_session()
 
-    # Check if the user message count reaches 5
-    if st.session_state.user_message_count >= 5:
+        # The last message changes the rest of the page, so rerun all of it
+        if st.session_state.user_message_count >= max_user_messages:
+            st.rerun()
+
+    chat_turn()
+
+    # Check if the user message count reaches the limit
+    if st.session_state.user_message_count >= max_user_messages:
         st.session_state.chat_complete = True
+        persist_session()
 
 # Show "Get Personalized Recommendations" 
 if st.session_state.chat_complete and not st.session_state.recommendations_shown:
@@ -284,190 +404,186 @@ if st.session_state.chat_complete and not st.session_state.recommendations_shown
 if st.session_state.recommendations_shown:
     st.subheader("Your Personalized Recommendations")
 
-    conversation_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in st.session_state.messages])
-
-    # Initialize new OpenAI client instance for recommendations
-    recommendations_client = OpenAI(api_key=st.secrets["OPEN_API_KEY"])
-
-    # Generate recommendations using the stored messages
-    recommendations_completion = recommendations_client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": """You are an anime and manga recommendation specialist.
-             Based on the conversation, provide a personalized list of recommendations in JSON compatible format.
-             For each recommendation include:
-             - title: Full title of the anime/manga
-             - year: Release year (if known)
-             - genre: Primary genre (e.g., action, romance, fantasy)
-             - content_type: Either "anime", "manga", "movie", or "light novel"
-             - description: Brief description (1-2 sentences)
-             - appeal: Why they'll love it based on their preferences
-             
-             Format your response with clear section headings and organize as follows:
-             
-             ## Overall Theme
-             [Brief description of what you think the user will enjoy]
-             
-             ## Top Recommendations
-             [List 5 recommendations with complete details for each]
-             
-             ## Hidden Gems
-             [List 3 lesser-known recommendations with complete details for each]
-             
-             ## Where to Watch/Read
-             [General information about legal platforms for anime/manga]
-             """},
-            {"role": "user", "content": f"Here's my conversation with AnimeVerse Guide. Please provide personalized recommendations based on this: {conversation_history}"}
-        ]
-    )
+    @st.fragment
+    def recommendation_page():
+        """Renders the recommendation sections, replaying the finished page on later reruns"""
+        # One container per section keeps page order even when sections finish out of order
+        section_containers = {section: st.container() for section in SECTION_TITLES}
+        rendered_sections = set()
+        page_events = []
+
+        def write_recommendation_event(section, value):
+            with section_containers[section]:
+                # Section headings are written the first time one of their entries arrives
+                if section not in rendered_sections:
+                    rendered_sections.add(section)
+                    st.markdown(f"## {SECTION_TITLES[section]}")
+                if isinstance(value, Recommendation):
+                    with metrics.timer("card_render", session_metrics):
+                        display_anime_card(value)
+                    st.markdown("---")
+                else:
+                    st.write(value)
+            page_events.append((section, value))
+
+        # The conversation is fixed once recommendations are shown, so a finished page is replayed
+        # without rebuilding the prompt, checking the cache or parsing again
+        if "recommendation_events" in st.session_state:
+            for section, value in st.session_state.recommendation_events:
+                write_recommendation_event(section, value)
+            return
+
+        catalogue = get_catalogue()
+        # Canonical titles where the catalogue knows the show, the user's own spelling where it doesn't
+        favorite_titles = [entry.title if entry is not None else name
+                           for name, entry in catalogue.match_favorites(st.session_state["favorite_anime"])]
+        conversation_history = build_recommendations_history(
+            st.session_state.messages, st.session_state, get_conversation_window(), catalogue,
+            shortlist_size=st.secrets.get("CATALOGUE_SHORTLIST_SIZE", 12),
+        )
 
-    # Get the recommendation text
-    recommendation_text = recommendations_completion.choices[0].message.content
-    
-    # Display the Overall Theme section
-    if "## Overall Theme" in recommendation_text:
-        theme_parts = recommendation_text.split("## Overall Theme", 1)
-        if len(theme_parts) > 1:
-            theme_content = theme_parts[1].split("##")[0].strip()
-            st.markdown("## Overall Theme")
-            st.write(theme_content)
-    
-    # Display Top Recommendations with enhanced visualization
-    if "## Top Recommendations" in recommendation_text:
-        st.markdown("## Top Recommendations")
-        
-        # Parse and extract each recommendation
-        top_rec_section = recommendation_text.split("## Top Recommendations", 1)[1].split("##")[0]
-        top_recommendations = top_rec_section.strip().split("\n\n")
-        
-        for rec in top_recommendations:
-            if not rec.strip():
-                continue
-                
-            # Extract details from the recommendation text
-            title = ""
-            year = ""
-            genre = ""
-            content_type = "anime"  # default
-            description = ""
-            appeal = ""
-            
-            # Parse the information
-            lines = rec.strip().split("\n")
-            for line in lines:
-                line = line.strip()
-                if line.startswith("1. ") or line.startswith("2. ") or line.startswith("3. ") or line.startswith("4. ") or line.startswith("5. "):
-                    # Extract title and possibly year from formats like "Title (2010)"
-                    title_part = line[3:].strip()
-                    if " - " in title_part:
-                        title_part = title_part.split(" - ")[0].strip()
-                    if " (" in title_part and ")" in title_part:
-                        title = title_part.split(" (")[0].strip()
-                        year = title_part.split(" (")[1].split(")")[0].strip()
-                    else:
-                        title = title_part
-                
-                if "genre:" in line.lower() or "genre" in line.lower():
-                    genre = line.split(":", 1)[1].strip() if ":" in line else ""
-                
-                if "type:" in line.lower() or "content type:" in line.lower():
-                    content_type = line.split(":", 1)[1].strip() if ":" in line else "anime"
-                
-                if "description:" in line.lower():
-                    description = line.split(":", 1)[1].strip() if ":" in line else ""
-                
-                if "appeal:" in line.lower() or "why they'll love it:" in line.lower() or "why you'll love it:" in line.lower():
-                    appeal = line.split(":", 1)[1].strip() if ":" in line else ""
-            
-            # If description wasn't explicitly labeled, use any remaining text
-            if not description and len(lines) > 1:
-                for line in lines[1:]:
-                    if not line.lower().startswith(("genre:", "type:", "content type:", "appeal:", "why they'll love it:", "why you'll love it:")) and not line.strip().startswith(("1.", "2.", "3.", "4.", "5.")):
-                        description += line.strip() + " "
-                description = description.strip()
-            
-            # Display the recommendation card
-            display_anime_card(
-                title=title,
-                genre=genre,
-                content_type=content_type,
-                description=description,
-                year=year,
-                appeal=appeal
-            )
-            st.markdown("---")
-    
-    # Display Hidden Gems section
-    if "## Hidden Gems" in recommendation_text:
-        st.markdown("## Hidden Gems")
-        
-        # Parse and extract each hidden gem
-        hidden_gems_section = recommendation_text.split("## Hidden Gems", 1)[1].split("##")[0]
-        hidden_gems = hidden_gems_section.strip().split("\n\n")
-        
-        for rec in hidden_gems:
-            if not rec.strip():
-                continue
-                
-            # Extract details (similar to above)
-            title = ""
-            year = ""
-            genre = ""
-            content_type = "anime"  # default
-            description = ""
-            appeal = ""
-            
-            # Parse the information
-            lines = rec.strip().split("\n")
-            for line in lines:
-                line = line.strip()
-                if line.startswith("1. ") or line.startswith("2. ") or line.startswith("3. "):
-                    # Extract title and possibly year
-                    title_part = line[3:].strip()
-                    if " - " in title_part:
-                        title_part = title_part.split(" - ")[0].strip()
-                    if " (" in title_part and ")" in title_part:
-                        title = title_part.split(" (")[0].strip()
-                        year = title_part.split(" (")[1].split(")")[0].strip()
-                    else:
-                        title = title_part
-                
-                if "genre:" in line.lower() or "genre" in line.lower():
-                    genre = line.split(":", 1)[1].strip() if ":" in line else ""
-                
-                if "type:" in line.lower() or "content type:" in line.lower():
-                    content_type = line.split(":", 1)[1].strip() if ":" in line else "anime"
-                
-                if "description:" in line.lower():
-                    description = line.split(":", 1)[1].strip() if ":" in line else ""
-                
-                if "appeal:" in line.lower() or "why they'll love it:" in line.lower() or "why you'll love it:" in line.lower():
-                    appeal = line.split(":", 1)[1].strip() if ":" in line else ""
-            
-            # If description wasn't explicitly labeled, use any remaining text
-            if not description and len(lines) > 1:
-                for line in lines[1:]:
-                    if not line.lower().startswith(("genre:", "type:", "content type:", "appeal:", "why they'll love it:", "why you'll love it:")) and not line.strip().startswith(("1.", "2.", "3.")):
-                        description += line.strip() + " "
-                description = description.strip()
-            
-            # Display the recommendation card
-            display_anime_card(
-                title=title,
-                genre=genre,
-                content_type=content_type,
-                description=description,
-                year=year,
-                appeal=appeal
-            )
-            st.markdown("---")
-    
-    # Display Where to Watch/Read section
-    if "## Where to Watch/Read" in recommendation_text:
-        st.markdown("## Where to Watch/Read")
-        watch_read_section = recommendation_text.split("## Where to Watch/Read", 1)[1].strip()
-        st.write(watch_read_section)
-    
-    # Button to start a new recommendation
-    if st.button("Start Fresh", type="primary"):
-            streamlit_js_eval(js_expressions="parent.window.location.reload()")
+        # "ndjson" (default) and "markdown" stream cards as they complete, "json" uses structured output
+        # and "sections" requests each section concurrently
+        recommendation_format = st.secrets.get("RECOMMENDATION_FORMAT", "ndjson")
+        system_prompt = recommendations_system_prompt(recommendation_format)
+
+        # Reruns with the same conversation render from cache instead of regenerating
+        recommendation_cache = get_recommendation_cache()
+        cache_key = make_cache_key(conversation_history, system_prompt, recommendations_model)
+        recommendation_text = recommendation_cache.get(cache_key)
+        cache_result = "miss" if recommendation_text is None else "hit"
+
+        # Otherwise another session with a near-identical profile and chat may have paid for a page already
+        semantic_cache = get_semantic_cache()
+        profile_bucket, profile_vector = profile_fingerprint(
+            st.session_state, st.session_state.messages, favorite_titles, recommendations_model, catalogue
+        )
+        if recommendation_text is None:
+            recommendation_text, _ = semantic_cache.lookup(profile_bucket, profile_vector)
+            if recommendation_text is not None:
+                cache_result = "semantic_hit"
+        metrics.increment("recommendation_cache_requests_total", 1, session_metrics, result=cache_result)
+
+        # "local" fills Hidden Gems from the offline similarity index instead of the model
+        local_hidden_gems = st.secrets.get("HIDDEN_GEMS_SOURCE", "model") == "local"
+
+        def render_recommendation_event(section, value, source="model"):
+            if local_hidden_gems and section == "hidden_gems" and source == "model":
+                return
+            if isinstance(value, Recommendation):
+                value = catalogue.canonicalize(value)
+            write_recommendation_event(section, value)
+
+        if local_hidden_gems:
+            for entry in get_similarity_index().hidden_gems(
+                st.session_state["favorite_anime"],
+                st.session_state["favorite_genres"],
+                st.session_state["content_type"],
+                st.session_state["content_length"],
+            ):
+                appeal = f"A lesser-known pick close to your taste in {', '.join(entry.genres)}."
+                render_recommendation_event("hidden_gems", recommendation_from_entry(entry, appeal), source="local")
+
+        if recommendation_text is not None:
+            with metrics.timer("recommendation_parse", session_metrics, format="cached"):
+                page = parse_recommendations(recommendation_text)
+            if cache_result == "semantic_hit":
+                # The page was written for someone else: re-address its prose and drop this user's favourites
+                page = personalize_page(page, st.session_state, favorite_titles, catalogue)
+            for section, value in iter_page_events(page):
+                render_recommendation_event(section, value)
+        else:
+            recommendation_messages = build_recommendations_messages(conversation_history, system_prompt)
+            record_context_usage("recommendations", {"input_tokens": count_message_tokens(recommendation_messages)})
+
+            llm_backend = session_llm_backend(queue_notice())
+            try:
+                if recommendation_format == "sections":
+                    # Each section is its own smaller request; render them in completion order
+                    page = RecommendationPage()
+                    failed_sections = []
+                    with st.spinner("Creating your personalized anime and manga list..."):
+                        sections = tuple(name for name in SECTION_PROMPTS if not (local_hidden_gems and name == "hidden_gems"))
+                        for section, value, error in iter_sections(get_background_loop(), llm_backend,
+                                                                   conversation_history, recommendations_model, sections):
+                            if error is not None:
+                                failed_sections.append(section)
+                                with section_containers[section]:
+                                    st.warning(f"Couldn't load {SECTION_TITLES[section]} right now.")
+                                continue
+                            setattr(page, section, value)
+                            for item in value if section in CARD_SECTIONS else [value]:
+                                render_recommendation_event(section, item)
+                    # Only complete pages are cached, so a failed section is retried on the next rerun
+                    recommendation_text = None if failed_sections else dump_recommendations(page)
+                elif recommendation_format == "json":
+                    # Generate recommendations using the stored messages
+                    recommendation_text = llm_backend.structured(
+                        recommendation_messages,
+                        recommendations_model,
+                        RECOMMENDATIONS_RESPONSE_FORMAT,
+                    )
+                    with metrics.timer("recommendation_parse", session_metrics, format="json"):
+                        page = parse_recommendations(recommendation_text)
+                    for section, value in iter_page_events(page):
+                        render_recommendation_event(section, value)
+                else:
+                    # Stream the completion and render each card as soon as it is complete
+                    parser = RecommendationStreamParser()
+                    text_parts = []
+                    # Parsing is timed apart from the model and rendering it is interleaved with
+                    parse_seconds = 0.0
+                    with st.spinner("Creating your personalized anime and manga list..."):
+                        for delta in llm_backend.stream_chat(recommendation_messages, recommendations_model):
+                            text_parts.append(delta)
+                            parse_started = time.perf_counter()
+                            events = parser.feed(delta)
+                            parse_seconds += time.perf_counter() - parse_started
+                            for section, value in events:
+                                render_recommendation_event(section, value)
+                        for section, value in parser.close():
+                            render_recommendation_event(section, value)
+                    metrics.observe("recommendation_parse_seconds", parse_seconds, session_metrics, format=recommendation_format)
+                    recommendation_text = "".join(text_parts)
+            except ModelBusyError as error:
+                # Nothing is cached, so the page is generated again on the next rerun
+                st.warning(f"The guide is swamped right now. Please try again in about "
+                           f"{max(error.retry_after, 1):.0f}s.")
+                st.button("Try again")
+                recommendation_text = None
+
+            if recommendation_text is not None:
+                recommendation_cache.set(cache_key, recommendation_text)
+                semantic_cache.set(profile_bucket, profile_vector, recommendation_text)
+
+        if recommendation_text is not None:
+            st.session_state.recommendation_events = page_events
+            if session_store is not None:
+                session_store.save_recommendations(st.session_state.session_token, page_events)
+
+    recommendation_page()
+
+    @st.fragment
+    def start_fresh():
+        # Button to start a new recommendation; clears the stored session instead of reloading the page
+        if st.button("Start Fresh", type="primary"):
+            reset_session()
+            st.rerun()
+
+    start_fresh()
+
+# Debug panel with this session's totals and the server-wide cache gauges
+if metrics.enabled and st.secrets.get("METRICS", {}).get("sidebar", False):
+    with st.sidebar.expander("Debug metrics"):
+        st.caption(f"Session {session_metrics.id}")
+        st.table([{"metric": name, "count": count, "total": round(total, 4)}
+                  for name, (count, total) in sorted(session_metrics.totals.items())])
+        st.table([{"metric": name, "value": round(value, 4)}
+                  for name, (count, value) in sorted(metrics.snapshot().items()) if count is None and "{" not in name])
+
+# Token counts of this session's recent requests; always recorded, shown when TOKEN_USAGE_SIDEBAR is set
+if st.secrets.get("TOKEN_USAGE_SIDEBAR", False) and st.session_state.token_usage:
+    with st.sidebar.expander("Token usage"):
+        st.table(list(st.session_state.token_usage))
+
+metrics.observe("script_run_seconds", time.perf_counter() - rerun_started, session_metrics, phase=rerun_phase)
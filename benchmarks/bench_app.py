@@ -0,0 +1,311 @@
+"""End-to-end benchmark: setup -> chat -> recommendations through AppTest with the fake LLM.
+
+Each simulated session runs app.py headlessly in its own process (AppTest
+swaps process-wide Streamlit state on every run, so sessions cannot share
+one), and all sessions run at the same time. Results are written as JSON;
+pass --baseline with an earlier file to print the change per metric.
+
+    python benchmarks/bench_app.py [--sessions 8] [--format ndjson] [--output bench_app.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "app.py")
+
+FAVORITES = ("Naruto, Mushishi", "Fullmetal Alchemist: Brotherhood", "Death Note, Monster", "Frieren, Made in Abyss",
+             "Steins;Gate", "Haikyu!!, Yotsuba&!", "Attack on Titan, Vinland Saga", "Spice and Wolf")
+GENRES = ("mecha, psychological", "fantasy, adventure", "mystery, thriller", "slice of life", "sci-fi",
+          "sports, comedy", "action, drama", "romance")
+
+# Per-process timings filled in by the instrumented backend and card builder
+_marks = {"run_started": 0.0, "first_tokens": [], "completions": [], "first_card": None}
+
+
+def _install_instrumentation():
+    import cards
+    import llm_backend
+
+    class TimedFakeBackend(llm_backend.FakeBackend):
+        def stream_chat(self, messages, model, **options):
+            first = True
+            kind = "recommendations" if "recommendation specialist" in messages[0]["content"] else "chat"
+            for delta in super().stream_chat(messages, model, **options):
+                if first:
+                    _marks["first_tokens"].append((kind, time.perf_counter() - _marks["run_started"]))
+                    first = False
+                yield delta
+
+        def chat(self, messages, model, **options):
+            started = time.perf_counter()
+            text = super().chat(messages, model, **options)
+            _marks["completions"].append(time.perf_counter() - started)
+            return text
+
+        async def achat(self, messages, model, **options):
+            started = time.perf_counter()
+            text = await super().achat(messages, model, **options)
+            _marks["completions"].append(time.perf_counter() - started)
+            return text
+
+    build_card_fragments = cards.build_card_fragments
+
+    def timed_build_card_fragments(recommendation):
+        if _marks["first_card"] is None:
+            _marks["first_card"] = time.perf_counter() - _marks["run_started"]
+        return build_card_fragments(recommendation)
+
+    llm_backend.FakeBackend = TimedFakeBackend
+    cards.build_card_fragments = timed_build_card_fragments
+
+
+def run_session(index, settings):
+    """Drives one session through the full flow and returns its timings"""
+    from streamlit.testing.v1 import AppTest
+
+    _install_instrumentation()
+    at = AppTest.from_file(APP_PATH, default_timeout=settings["timeout"])
+    at.secrets["OPEN_API_KEY"] = "benchmark"
+    at.secrets["LLM_BACKEND"] = "fake"
+    at.secrets["FAKE_LLM"] = {
+        "tokens_per_second": settings["tokens_per_second"],
+        "first_token_median": settings["first_token_median"],
+        "first_token_sigma": settings["first_token_sigma"],
+        "seed": settings["seed"] + index,
+    }
+    at.secrets["RECOMMENDATION_FORMAT"] = settings["format"]
+    at.secrets["MAX_USER_MESSAGES"] = settings["chat_turns"]
+
+    phases = {"load": [], "setup": [], "chat_turn": [], "recommendations": [], "cached_rerun": []}
+    reruns = 0
+
+    def timed(phase, step):
+        nonlocal reruns
+        _marks["run_started"] = time.perf_counter()
+        step()
+        phases[phase].append(time.perf_counter() - _marks["run_started"])
+        reruns += 1
+
+    timed("load", at.run)
+    at.text_input[0].input(f"Bench {index}")
+    at.text_area[0].input(FAVORITES[index % len(FAVORITES)])
+    at.text_area[1].input(GENRES[index % len(GENRES)])
+    timed("setup", at.run)
+    timed("setup", at.button[0].click().run)
+    for turn in range(settings["chat_turns"]):
+        timed("chat_turn", at.chat_input[0].set_value(f"Session {index} message {turn}: something like that").run)
+    _marks["first_card"] = None
+    timed("recommendations", at.button[0].click().run)
+    time_to_first_card = _marks["first_card"]
+    timed("cached_rerun", at.run)
+
+    return {
+        "phases": phases,
+        "reruns": reruns,
+        "first_tokens": _marks["first_tokens"],
+        "completions": _marks["completions"],
+        "time_to_first_card": time_to_first_card,
+        "cards": sum(1 for element in at.markdown if element.value.startswith("#### ")),
+        "errors": [str(exception.value) for exception in at.exception],
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024),
+    }
+
+
+def percentiles(values, scale=1000.0):
+    """Summarizes a list of seconds as milliseconds"""
+    if not values:
+        return None
+    ordered = sorted(value * scale for value in values)
+
+    def rank(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+
+    return {"count": len(ordered), "mean": round(sum(ordered) / len(ordered), 3), "p50": rank(0.5),
+            "p90": rank(0.9), "p95": rank(0.95), "p99": rank(0.99), "max": round(ordered[-1], 3)}
+
+
+def _render_page():
+    import os
+
+    from cards import display_anime_card
+    from recommendations import parse_recommendations
+
+    with open(os.environ["BENCH_PAGE_PATH"], encoding="utf-8") as handle:
+        page = parse_recommendations(handle.read())
+    for recommendation in page.top_recommendations + page.hidden_gems:
+        display_anime_card(recommendation)
+
+
+def _empty_page():
+    import streamlit as st
+
+    st.empty()
+
+
+def micro_benchmarks(rounds):
+    """Times recommendation parsing and card rendering in isolation"""
+    import tempfile
+
+    from llm_backend import FakeBackend
+    from prompts import RECOMMENDATIONS_JSON_SYSTEM_PROMPT, RECOMMENDATIONS_NDJSON_SYSTEM_PROMPT, \
+        RECOMMENDATIONS_SYSTEM_PROMPT
+    from recommendations import RECOMMENDATIONS_RESPONSE_FORMAT, RecommendationStreamParser, parse_recommendations
+    from streamlit.testing.v1 import AppTest
+
+    backend = FakeBackend.from_jsonl()
+    texts = {
+        "ndjson": backend._response_for([{"role": "system", "content": RECOMMENDATIONS_NDJSON_SYSTEM_PROMPT}]),
+        "markdown": backend._response_for([{"role": "system", "content": RECOMMENDATIONS_SYSTEM_PROMPT}]),
+        "json": backend._response_for([{"role": "system", "content": RECOMMENDATIONS_JSON_SYSTEM_PROMPT}],
+                                      RECOMMENDATIONS_RESPONSE_FORMAT),
+    }
+    results = {}
+    for name, text in texts.items():
+        best = min(timeit.repeat(lambda: parse_recommendations(text), number=rounds, repeat=5))
+        results[f"parse_{name}_us"] = round(best / rounds * 1e6, 2)
+        if name == "json":
+            continue
+        chunks = backend._tokens(text)
+
+        def stream():
+            parser = RecommendationStreamParser()
+            for chunk in chunks:
+                parser.feed(chunk)
+            parser.close()
+
+        best = min(timeit.repeat(stream, number=rounds, repeat=5))
+        results[f"stream_parse_{name}_us"] = round(best / rounds * 1e6, 2)
+
+    # Card rendering through a real script run, less the cost of an empty run
+    with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False, encoding="utf-8") as handle:
+        handle.write(texts["ndjson"])
+    os.environ["BENCH_PAGE_PATH"] = handle.name
+    try:
+        timings = {}
+        for name, function in (("page", _render_page), ("empty", _empty_page)):
+            at = AppTest.from_function(function, default_timeout=60)
+            at.run()
+            samples = []
+            for _ in range(max(5, rounds // 100)):
+                started = time.perf_counter()
+                at.run()
+                samples.append(time.perf_counter() - started)
+            timings[name] = sorted(samples)[len(samples) // 2]
+        page = parse_recommendations(texts["ndjson"])
+        card_count = len(page.top_recommendations) + len(page.hidden_gems)
+        results["render_page_ms"] = round(timings["page"] * 1000, 3)
+        results["render_card_ms"] = round((timings["page"] - timings["empty"]) / card_count * 1000, 3)
+    finally:
+        os.unlink(handle.name)
+    return results
+
+
+def summarize(sessions, settings, micro, wall_time):
+    """Combines per-session results into the JSON report"""
+    phases = {}
+    for phase in sessions[0]["phases"]:
+        phases[phase] = percentiles([value for session in sessions for value in session["phases"][phase]])
+    first_tokens = {}
+    for kind in ("chat", "recommendations"):
+        first_tokens[kind] = percentiles([value for session in sessions
+                                          for token_kind, value in session["first_tokens"] if token_kind == kind])
+    rss = sorted(session["peak_rss_mb"] for session in sessions)
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": settings,
+        "wall_time_s": round(wall_time, 3),
+        "phases_ms": phases,
+        "time_to_first_token_ms": first_tokens,
+        "completion_ms": percentiles([value for session in sessions for value in session["completions"]]),
+        "time_to_first_card_ms": percentiles([session["time_to_first_card"] for session in sessions
+                                              if session["time_to_first_card"] is not None]),
+        "reruns_per_session": percentiles([session["reruns"] for session in sessions], scale=1),
+        "cards_per_session": percentiles([session["cards"] for session in sessions], scale=1),
+        "peak_rss_mb_per_session": {"p50": round(rss[len(rss) // 2], 1), "max": round(rss[-1], 1)},
+        "errors": [error for session in sessions for error in session["errors"]],
+        "micro": micro,
+    }
+
+
+def _flatten(report, prefix=""):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def compare(report, baseline):
+    """Prints the relative change of every timing shared with a baseline report"""
+    previous = dict(_flatten({key: baseline.get(key) for key in ("phases_ms", "time_to_first_token_ms",
+                                                                 "time_to_first_card_ms", "micro")}))
+    for name, value in _flatten({key: report.get(key) for key in ("phases_ms", "time_to_first_token_ms",
+                                                                 "time_to_first_card_ms", "micro")}):
+        if not (name.startswith("micro.") or name.endswith((".p50", ".p95"))) or not previous.get(name):
+            continue
+        change = (value - previous[name]) / previous[name] * 100
+        print(f"{name:<45} {previous[name]:>10.2f} -> {value:>10.2f}  {change:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8, help="concurrent simulated sessions")
+    parser.add_argument("--chat-turns", type=int, default=5, help="user messages per session")
+    parser.add_argument("--format", default="ndjson", choices=("ndjson", "markdown", "json", "sections"))
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--first-token-median", type=float, default=0.4, help="seconds")
+    parser.add_argument("--first-token-sigma", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds allowed per script run")
+    parser.add_argument("--micro-rounds", type=int, default=2000)
+    parser.add_argument("--output", default="bench_app.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    settings = {"sessions": args.sessions, "chat_turns": args.chat_turns, "format": args.format,
+                "tokens_per_second": args.tokens_per_second, "first_token_median": args.first_token_median,
+                "first_token_sigma": args.first_token_sigma, "seed": args.seed, "timeout": args.timeout}
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.sessions) as pool:
+        sessions = list(pool.map(run_session, range(args.sessions), [settings] * args.sessions))
+    wall_time = time.perf_counter() - started
+    report = summarize(sessions, settings, micro_benchmarks(args.micro_rounds), wall_time)
+
+    with open(args.output, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2)
+    for phase, stats in report["phases_ms"].items():
+        print(f"{phase:>16}: p50 {stats['p50']:9.1f} ms  p95 {stats['p95']:9.1f} ms  (n={stats['count']})")
+    for name, stats in (("ttft chat", report["time_to_first_token_ms"]["chat"]),
+                        ("first card", report["time_to_first_card_ms"])):
+        if stats:
+            print(f"{name:>16}: p50 {stats['p50']:9.1f} ms  p95 {stats['p95']:9.1f} ms")
+    print(f"{'peak rss':>16}: {report['peak_rss_mb_per_session']['max']:.1f} MB per session")
+    if report["errors"]:
+        print(f"{len(report['errors'])} errors, first: {report['errors'][0]}")
+    print(f"wrote {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            compare(report, json.load(handle))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Micro-benchmark: building the card pieces for a full recommendations page.
+
+Compares the previous per-call approach (dict literals and HTML f-strings
+rebuilt on every call) with the precomputed registry, templates and
+memoized card fragments in cards.py.
+
+    python benchmarks/bench_cards.py
+"""
+
+import os
+import sys
+import timeit
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cards import build_card_fragments  # noqa: E402
+from posters import render_poster  # noqa: E402
+from recommendations import Recommendation  # noqa: E402
+
+
+PAGE = [
+    Recommendation("Frieren: Beyond Journey's End", "2023", "Fantasy", "anime", "An elf mage looks back.", "Quiet and moving."),
+    Recommendation("Vinland Saga", "2019", "Action", "anime", "A Viking revenge saga.", "Great character growth."),
+    Recommendation("Steins;Gate", "2011", "Sci-Fi", "anime", "Microwave time travel.", "Twisty plot."),
+    Recommendation("Monster", "2004", "Psychological", "anime", "A surgeon hunts a killer.", "Tense."),
+    Recommendation("Yotsuba&!", "2003", "Slice of Life", "manga", "A curious girl explores.", "Pure comfort."),
+    Recommendation("Mushishi", "2005", "Supernatural", "anime", "A wanderer studies mushi.", "Atmospheric."),
+    Recommendation("Planetes", "2003", "science fiction", "anime", "Space debris collectors.", "Grounded sci-fi."),
+    Recommendation("Spice and Wolf", "2006", "Romance", "light novel", "A merchant and a wolf goddess.", "Witty banter."),
+]
+
+
+def _previous_themed_placeholder(title, content_type="anime", genre=None):
+    type_emoji = {
+        "manga": "📚",
+        "movie": "🎬",
+        "light novel": "📘",
+        "anime": "📺"
+    }.get(content_type.lower(), "✨")
+    genre_colors = {
+        "action": "FF5733/FFFFFF",
+        "romance": "FF9EF0/000000",
+        "comedy": "FFEC33/000000",
+        "horror": "300030/FF0000",
+        "fantasy": "33A1FF/FFFFFF",
+        "default": "3357FF/FFFFFF"
+    }
+    colors = genre_colors.get(genre.lower() if genre else "default", genre_colors["default"])
+    dimensions = {
+        "manga": "350x500",
+        "movie": "300x450",
+        "light novel": "250x400",
+        "anime": "300x450"
+    }.get(content_type.lower(), "300x450")
+    return render_poster(title, colors, type_emoji, content_type, dimensions)
+
+
+def _previous_links(title):
+    mal_link = f"https://myanimelist.net/search/all?q={quote(title)}"
+    anilist_link = f"https://anilist.co/search/anime?search={quote(title)}"
+    return f"""
+    <div style="margin-top: 10px; margin-bottom: 10px;">
+        <a href="{mal_link}" target="_blank" style="text-decoration: none; padding: 5px 10px; background-color: #2E51A2; color: white; border-radius: 5px; margin-right: 10px;">
+            MyAnimeList
+        </a>
+        <a href="{anilist_link}" target="_blank" style="text-decoration: none; padding: 5px 10px; background-color: #02A9FF; color: white; border-radius: 5px;">
+            AniList
+        </a>
+    </div>
+    """
+
+
+def _previous_trailer(anime_title):
+    search_query = f"{anime_title} official trailer"
+    youtube_search = f"https://www.youtube.com/results?search_query={quote(search_query)}"
+    return f"""
+    <a href="{youtube_search}" target="_blank" style="text-decoration: none; padding: 5px 10px; background-color: #FF0000; color: white; border-radius: 5px; display: inline-block;">
+        <span style="vertical-align: middle;">▶️ Watch Trailer</span>
+    </a>
+    """
+
+
+def previous_page():
+    for rec in PAGE:
+        _previous_themed_placeholder(rec.title, rec.content_type, rec.genre)
+        f"#### {rec.title} ({rec.year})" if rec.year else f"#### {rec.title}"
+        f"**Genre:** {rec.genre.title()}"
+        f"**Why you'll enjoy it:** {rec.appeal}"
+        _previous_links(rec.title)
+        _previous_trailer(rec.title)
+
+
+def current_page():
+    for rec in PAGE:
+        build_card_fragments(rec)
+
+
+def main(number=20000):
+    # Warm the poster cache so both sides measure only per-rerun work
+    previous_page()
+    current_page()
+    results = {}
+    for name, func in (("previous", previous_page), ("current", current_page)):
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        results[name] = best / number * 1e6
+        print(f"{name:>8}: {results[name]:8.2f} us per 8-card page")
+    print(f" speedup: {results['previous'] / results['current']:8.2f}x")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Micro-benchmark: local hidden-gem scoring over a synthetic 50k-entry catalogue.
+
+    python benchmarks/bench_similarity.py [entries]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalogue import CONTENT_TYPES, Catalogue  # noqa: E402
+from genres import GENRE_COLORS  # noqa: E402
+from similarity import SimilarityIndex  # noqa: E402
+
+
+def synthetic_records(count, seed=7):
+    rng = random.Random(seed)
+    genres = [genre for genre in GENRE_COLORS if genre != "default"]
+    tags = [f"tag{index}" for index in range(240)]
+    for index in range(count):
+        content_type = rng.choice(CONTENT_TYPES)
+        yield {
+            "title": f"Synthetic Title {index}",
+            "year": rng.randint(1970, 2025),
+            "type": content_type,
+            "genres": rng.sample(genres, rng.randint(1, 4)),
+            "tags": rng.sample(tags, rng.randint(0, 5)),
+            "episodes": rng.randint(1, 200) if content_type == "anime" else (1 if content_type == "movie" else None),
+            "volumes": rng.randint(1, 60) if content_type in ("manga", "light novel") else None,
+            "status": rng.choice(("finished", "ongoing")),
+            "popularity": rng.randint(1, 5),
+        }
+
+
+def main(count=50000, rounds=200):
+    started = time.perf_counter()
+    catalogue = Catalogue(synthetic_records(count))
+    index = SimilarityIndex.build(catalogue)
+    print(f"build: {(time.perf_counter() - started) * 1000:.0f} ms for {count} entries x {len(index.vocabulary)} terms")
+
+    profile = index.profile_vector([1, 2, 3], "mecha, psychological")
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        mask = index.preference_mask("Anime only", "Medium (12-24 episodes/3-10 volumes)", max_popularity=2)
+        index.top_k(profile, 3, mask, exclude={1, 2, 3})
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(f"score+filter+top-k: median {timings[len(timings) // 2]:.2f} ms, p95 {timings[int(len(timings) * 0.95)]:.2f} ms")
+    return timings
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,111 @@
+"""Recommendation cards and their precomputed building blocks"""
+
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import quote
+
+import streamlit as st
+
+from genres import content_type_info, genre_colors, normalize_content_type
+from posters import render_poster
+
+
+LINKS_TEMPLATE = """
+    <div style="margin-top: 10px; margin-bottom: 10px;">
+        <a href="https://myanimelist.net/search/all?q={title}" target="_blank" style="text-decoration: none; padding: 5px 10px; background-color: #2E51A2; color: white; border-radius: 5px; margin-right: 10px;">
+            MyAnimeList
+        </a>
+        <a href="https://anilist.co/search/anime?search={title}" target="_blank" style="text-decoration: none; padding: 5px 10px; background-color: #02A9FF; color: white; border-radius: 5px;">
+            AniList
+        </a>
+    </div>
+    """
+
+TRAILER_TEMPLATE = """
+    <a href="https://www.youtube.com/results?search_query={query}" target="_blank" style="text-decoration: none; padding: 5px 10px; background-color: #FF0000; color: white; border-radius: 5px; display: inline-block;">
+        <span style="vertical-align: middle;">▶️ Watch Trailer</span>
+    </a>
+    """
+
+CardFragments = namedtuple("CardFragments", ["image", "heading", "genre", "description", "appeal", "links", "trailer"])
+
+
+def get_anime_placeholder(title, genre=None, dimensions="300x450"):
+    """Creates custom anime-themed placeholder images as PNG bytes"""
+    return render_poster(title, genre_colors(genre), dimensions=dimensions)
+
+
+def get_themed_placeholder(title, content_type="anime", genre=None):
+    """Creates placeholders with different layouts based on content type"""
+    info = content_type_info(content_type)
+    label = normalize_content_type(content_type)
+    return render_poster(title, genre_colors(genre), info.emoji, label if label != "default" else content_type,
+                         info.dimensions)
+
+
+def create_anime_links(title):
+    """Create formatted links to popular anime databases for a given title"""
+    return LINKS_TEMPLATE.format(title=quote(title))
+
+
+def embed_youtube_trailer(anime_title):
+    """Creates a YouTube search link for an anime trailer"""
+    return TRAILER_TEMPLATE.format(query=quote(f"{anime_title} official trailer"))
+
+
+@lru_cache(maxsize=512)
+def _card_fragments(title, year, genre, content_type, description, appeal):
+    return CardFragments(
+        image=get_themed_placeholder(title, content_type, genre),
+        heading=f"#### {title} ({year})" if year else f"#### {title}",
+        genre=f"**Genre:** {genre.title()}" if genre else "",
+        description=description,
+        appeal=f"**Why you'll enjoy it:** {appeal}" if appeal else "",
+        links=create_anime_links(title),
+        trailer=embed_youtube_trailer(title),
+    )
+
+
+def build_card_fragments(recommendation):
+    """Returns the memoized image and markdown/HTML pieces for a Recommendation's card"""
+    return _card_fragments(recommendation.title, recommendation.year, recommendation.genre,
+                           recommendation.content_type, recommendation.description, recommendation.appeal)
+
+
+def card_cache_info():
+    """Returns hit/miss statistics for the memoized card fragments"""
+    return _card_fragments.cache_info()
+
+
+def display_anime_card(recommendation):
+    """Displays an enhanced anime recommendation card"""
+    
+    # Image, markdown and HTML pieces are built once per recommendation and reused across reruns
+    card = build_card_fragments(recommendation)
+
+    # Create columns for card layout
+    col1, col2 = st.columns([1, 2])
+    
+    with col1:
+        # Display the placeholder image based on content type and genre
+        st.image(card.image, use_column_width=True)
+    
+    with col2:
+        # Title with year if available
+        st.markdown(card.heading)
+        
+        # Genre badge if available
+        if card.genre:
+            st.markdown(card.genre)
+        
+        # Description
+        if card.description:
+            st.write(card.description)
+        
+        # Appeal/why they'll like it
+        if card.appeal:
+            st.markdown(card.appeal)
+        
+        # External links
+        st.markdown(card.links, unsafe_allow_html=True)
+        st.markdown(card.trailer, unsafe_allow_html=True)
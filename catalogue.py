@@ -0,0 +1,289 @@
+"""Offline anime/manga catalogue with genre and fuzzy title indexes"""
+
+import json
+import os
+import re
+from array import array
+from collections import defaultdict, namedtuple
+
+from genres import normalize_content_type, normalize_genre
+from recommendations import Recommendation
+
+
+DEFAULT_CATALOGUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "catalogue.jsonl")
+
+CONTENT_TYPES = ("anime", "manga", "movie", "light novel")
+
+# Setup-screen choices mapped onto catalogue content types
+CONTENT_TYPE_FILTERS = {
+    "Both anime and manga": ("anime", "manga", "movie"),
+    "Anime only": ("anime", "movie"),
+    "Manga only": ("manga",),
+    "Light novels": ("light novel",),
+    "Movies": ("movie",),
+}
+
+# Setup-screen length choices as ((min, max) episodes, (min, max) volumes); movies count as short
+CONTENT_LENGTH_FILTERS = {
+    "Short (1-12 episodes/1-3 volumes)": ((1, 12), (1, 3)),
+    "Medium (12-24 episodes/3-10 volumes)": ((13, 24), (4, 10)),
+    "Long (24+ episodes/10+ volumes)": ((25, 65535), (11, 65535)),
+}
+
+CatalogueEntry = namedtuple(
+    "CatalogueEntry",
+    ["id", "title", "aliases", "year", "content_type", "genres", "tags", "episodes", "volumes", "finished", "popularity"],
+)
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+_LIST_SEPARATORS = re.compile(r"[,;\n]|\s/\s")
+
+
+def split_list(text):
+    """Splits a free-form list typed on the setup screen into its non-empty, stripped parts"""
+    return [part.strip() for part in _LIST_SEPARATORS.split(text or "") if part.strip()]
+
+
+def normalize_title(title):
+    """Lower-cases a title and collapses punctuation so spelling variants compare equal"""
+    return _NON_WORD.sub(" ", title.lower()).strip()
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Catalogue:
+    """Column-oriented catalogue store.
+
+    Each field lives in its own list or typed array indexed by entry id, so
+    a scan over one field (year, type, length) touches only that column.
+    Genres and tags have an inverted index of sorted id arrays, and titles
+    plus aliases have an exact-match table and a trigram index for fuzzy
+    lookups.
+    """
+
+    def __init__(self, records):
+        self.titles = []
+        self.aliases = []
+        self.genres = []
+        self.tags = []
+        self.years = array("H")
+        self.type_codes = array("B")
+        self.episodes = array("H")
+        self.volumes = array("H")
+        self.finished = array("B")
+        self.popularity = array("B")
+        self._postings = defaultdict(lambda: array("I"))
+        self._trigram_index = defaultdict(lambda: array("I"))
+        self._exact_titles = {}
+        self._title_trigram_counts = []
+
+        for record in records:
+            content_type = normalize_content_type(record.get("type") or "anime")
+            # Rows of a type the app has no place for (music videos, specials without a type...) are skipped
+            if content_type in CONTENT_TYPES:
+                self._add(record, content_type)
+        self._postings = dict(self._postings)
+        self._trigram_index = dict(self._trigram_index)
+
+    @classmethod
+    def load(cls, path=DEFAULT_CATALOGUE_PATH):
+        """Loads a catalogue from a JSON-lines dump"""
+        with open(path, encoding="utf-8") as handle:
+            return cls(json.loads(line) for line in handle if line.strip())
+
+    def __len__(self):
+        return len(self.titles)
+
+    def _add(self, record, content_type):
+        entry_id = len(self.titles)
+        genres = tuple(dict.fromkeys(normalize_genre(g) for g in record.get("genres", ())))
+        tags = tuple(tag.lower() for tag in record.get("tags", ()))
+        self.titles.append(record["title"])
+        self.aliases.append(tuple(record.get("aliases", ())))
+        self.genres.append(genres)
+        self.tags.append(tags)
+        self.years.append(record.get("year") or 0)
+        self.type_codes.append(CONTENT_TYPES.index(content_type))
+        self.episodes.append(record.get("episodes") or 0)
+        self.volumes.append(record.get("volumes") or 0)
+        self.finished.append(record.get("status") == "finished")
+        self.popularity.append(record.get("popularity") or 0)
+
+        for term in set(genres) | set(tags):
+            if term != "default":
+                self._postings[term].append(entry_id)
+
+        names = {normalize_title(name) for name in (record["title"], *record.get("aliases", ()))}
+        trigrams = set()
+        for name in names:
+            self._exact_titles.setdefault(name, entry_id)
+            trigrams |= _trigrams(name)
+        for trigram in trigrams:
+            self._trigram_index[trigram].append(entry_id)
+        self._title_trigram_counts.append(len(trigrams))
+
+    def entry(self, entry_id):
+        """Materializes one row as a CatalogueEntry"""
+        return CatalogueEntry(
+            id=entry_id,
+            title=self.titles[entry_id],
+            aliases=self.aliases[entry_id],
+            year=self.years[entry_id] or None,
+            content_type=CONTENT_TYPES[self.type_codes[entry_id]],
+            genres=self.genres[entry_id],
+            tags=self.tags[entry_id],
+            episodes=self.episodes[entry_id] or None,
+            volumes=self.volumes[entry_id] or None,
+            finished=bool(self.finished[entry_id]),
+            popularity=self.popularity[entry_id],
+        )
+
+    def search_title(self, query, limit=5, min_score=0.35):
+        """Returns [(entry_id, score)] for titles or aliases resembling query, best first"""
+        name = normalize_title(query)
+        if not name:
+            return []
+        if name in self._exact_titles:
+            return [(self._exact_titles[name], 1.0)]
+        query_trigrams = _trigrams(name)
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for entry_id in self._trigram_index.get(trigram, ()):
+                shared[entry_id] += 1
+        scored = []
+        for entry_id, count in shared.items():
+            # Dice coefficient over the query and the entry's combined title/alias trigrams
+            score = 2 * count / (len(query_trigrams) + self._title_trigram_counts[entry_id])
+            if score >= min_score:
+                scored.append((entry_id, score))
+        scored.sort(key=lambda item: -item[1])
+        return scored[:limit]
+
+    def resolve(self, title, min_score=0.5):
+        """Returns the canonical entry for a title, or None if nothing is close enough"""
+        matches = self.search_title(title, limit=1, min_score=min_score)
+        return self.entry(matches[0][0]) if matches else None
+
+    def lookup(self, title):
+        """Returns the entry whose title or alias equals title once normalized, or None.
+
+        Model output is matched this way rather than with resolve(): sequels
+        and spin-offs ("Naruto Shippuden", "Dragon Ball Super") score close
+        to their parent series but are different shows.
+        """
+        entry_id = self._exact_titles.get(normalize_title(title))
+        return self.entry(entry_id) if entry_id is not None else None
+
+    def canonicalize(self, recommendation):
+        """Fills a parsed Recommendation's canonical title and missing details from the catalogue"""
+        entry = self.lookup(recommendation.title)
+        if entry is None:
+            return recommendation
+        recommendation.title = entry.title
+        if not recommendation.year and entry.year:
+            recommendation.year = str(entry.year)
+        if not recommendation.genre and entry.genres:
+            recommendation.genre = entry.genres[0]
+        return recommendation
+
+    def matches_preferences(self, entry_id, content_type="Both anime and manga", content_length="No preference"):
+        """Checks an entry against the setup screen's content type and length choices"""
+        allowed = CONTENT_TYPE_FILTERS.get(content_type)
+        type_name = CONTENT_TYPES[self.type_codes[entry_id]]
+        if allowed is not None and type_name not in allowed:
+            return False
+        if content_length == "Completed series only":
+            return bool(self.finished[entry_id])
+        bands = CONTENT_LENGTH_FILTERS.get(content_length)
+        if bands is None:
+            return True
+        if type_name == "movie":
+            return content_length.startswith("Short")
+        (low, high) = bands[0] if self.episodes[entry_id] else bands[1]
+        length = self.episodes[entry_id] or self.volumes[entry_id]
+        return not length or low <= length <= high
+
+    def match_favorites(self, text):
+        """Yields (name, entry) for each title in a free-form favourites list; entry is None if it isn't catalogued"""
+        for part in split_list(text):
+            entry = self.resolve(part)
+            if entry is None and " and " in part:
+                # "Naruto and Bleach", but only once "Spice and Wolf" failed as a whole
+                names = [name.strip() for name in part.split(" and ") if name.strip()]
+                entries = [self.resolve(name) for name in names]
+                if any(entries):
+                    yield from zip(names, entries)
+                    continue
+            yield part, entry
+
+    def resolve_favorites(self, text):
+        """Yields catalogue entries for a free-form list of favourite titles"""
+        return (entry for _, entry in self.match_favorites(text) if entry is not None)
+
+    def find_titles(self, text):
+        """Returns the canonical titles of catalogue entries named anywhere in free text"""
+        padded = f" {normalize_title(text)} "
+        # Very short names ("aot") are too easily part of ordinary words or typos
+        return {self.titles[entry_id] for name, entry_id in self._exact_titles.items()
+                if len(name) >= 4 and f" {name} " in padded}
+
+    def shortlist(self, favorite_anime="", favorite_genres="", content_type="Both anime and manga",
+                  content_length="No preference", limit=10):
+        """Ranks catalogue entries for a setup profile.
+
+        Stated genres weigh most, then the genres and tags of recognised
+        favourites. Favourites themselves are excluded and ties go to the
+        more popular entry.
+        """
+        weights = defaultdict(float)
+        favorites = set()
+        for entry in self.resolve_favorites(favorite_anime or ""):
+            favorites.add(entry.id)
+            for genre in entry.genres:
+                weights[genre] += 1.0
+            for tag in entry.tags:
+                weights[tag] += 0.5
+        for part in split_list(favorite_genres):
+            part = part.lower()
+            genre = normalize_genre(part)
+            if genre != "default":
+                weights[genre] += 2.0
+            if part in self._postings:
+                weights[part] += 2.0
+
+        scores = defaultdict(float)
+        for term, weight in weights.items():
+            for entry_id in self._postings.get(term, ()):
+                scores[entry_id] += weight
+        if not scores:
+            # Nothing recognised: fall back to the most popular matching entries
+            scores = dict.fromkeys(range(len(self)), 0.0)
+
+        ranked = sorted(
+            (entry_id for entry_id in scores
+             if entry_id not in favorites and self.matches_preferences(entry_id, content_type, content_length)),
+            key=lambda entry_id: (-scores[entry_id], -self.popularity[entry_id], self.titles[entry_id]),
+        )
+        return [self.entry(entry_id) for entry_id in ranked[:limit]]
+
+
+def recommendation_from_entry(entry, appeal=""):
+    """Builds a card-ready Recommendation from a catalogue entry"""
+    if entry.episodes:
+        length = f"{entry.episodes} episode{'s' if entry.episodes != 1 else ''}"
+    elif entry.volumes:
+        length = f"{entry.volumes} volume{'s' if entry.volumes != 1 else ''}"
+    else:
+        length = ""
+    details = [length, "completed" if entry.finished else "ongoing", ", ".join(entry.tags)]
+    return Recommendation(
+        title=entry.title,
+        year=str(entry.year) if entry.year else "",
+        genre=entry.genres[0] if entry.genres else "",
+        content_type=entry.content_type,
+        description=" · ".join(part for part in details if part).capitalize(),
+        appeal=appeal,
+    )
@@ -0,0 +1,55 @@
+"""Factories for pooled OpenAI clients shared across Streamlit sessions"""
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+
+DEFAULT_CLIENT_SETTINGS = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "timeout": 60.0,
+    "connect_timeout": 5.0,
+    "max_retries": 3,
+}
+
+
+def _client_options(settings):
+    options = dict(DEFAULT_CLIENT_SETTINGS)
+    options.update(settings or {})
+    limits = httpx.Limits(
+        max_connections=options["max_connections"],
+        max_keepalive_connections=options["max_keepalive_connections"],
+        keepalive_expiry=options["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(options["timeout"], connect=options["connect_timeout"])
+    return limits, timeout, options["max_retries"]
+
+
+def build_openai_client(api_key, settings=None):
+    """Creates an OpenAI client with one keep-alive connection pool.
+
+    The client (and its httpx pool) is thread-safe, so one instance can serve
+    every session's script thread. Retries use the SDK's exponential backoff.
+    """
+    limits, timeout, max_retries = _client_options(settings)
+    return OpenAI(
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=max_retries,
+        http_client=DefaultHttpxClient(limits=limits, timeout=timeout),
+    )
+
+
+def build_async_openai_client(api_key, settings=None):
+    """Creates an AsyncOpenAI client with the same pool settings as build_openai_client.
+
+    Async clients must only be used from the event loop they first ran on.
+    """
+    limits, timeout, max_retries = _client_options(settings)
+    return AsyncOpenAI(
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=max_retries,
+        http_client=DefaultAsyncHttpxClient(limits=limits, timeout=timeout),
+    )
@@ -0,0 +1,151 @@
+"""Token-budgeted conversation window with a running summary of older turns"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# Rough per-message framing overhead used by chat models
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_FIRST_SENTENCE = re.compile(r"^(.+?[.!?])(?:\s|$)", re.DOTALL)
+
+
+@lru_cache(maxsize=8)
+def _encoding_for_model(model):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        # Unknown model or the BPE file can't be fetched; fall back to the estimate
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text, model="gpt-4o"):
+    """Counts tokens with tiktoken when available, otherwise estimates ~4 characters per token"""
+    encoding = _encoding_for_model(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def _api_message(message):
+    return {"role": message["role"], "content": message["content"]}
+
+
+def count_message_tokens(messages, model="gpt-4o"):
+    """Counts the prompt tokens for a list of chat messages"""
+    return sum(count_tokens(m["content"], model) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def extractive_summary(previous_summary, messages, max_tokens):
+    """Summarizes turns locally by keeping the first sentence of each one"""
+    parts = [previous_summary] if previous_summary else []
+    for message in messages:
+        content = " ".join(message["content"].split())
+        match = _FIRST_SENTENCE.match(content)
+        sentence = match.group(1) if match else content
+        parts.append(f"{message['role']}: {sentence[:200]}")
+    summary = " ".join(parts)
+    # Keep the most recent part of the summary when it outgrows its budget
+    max_chars = max_tokens * 4
+    if len(summary) > max_chars:
+        summary = "..." + summary[-max_chars:]
+    return summary
+
+
+class ConversationWindow:
+    """Fits a chat history into a token budget.
+
+    The leading system prompt and the most recent turns are sent verbatim;
+    older turns are folded into a running summary. Summaries are cached by a
+    rolling hash of the turns they cover, so each turn is only summarized
+    once as the conversation grows. Pass summarize(previous_summary,
+    messages, max_tokens) to replace the local extractive summary with, for
+    example, a call to a smaller model.
+    """
+
+    def __init__(self, token_budget=3000, summary_tokens=400, min_recent_messages=2,
+                 model="gpt-4o", summarize=extractive_summary, max_cached_summaries=1024):
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.min_recent_messages = min_recent_messages
+        self.model = model
+        self.summarize = summarize
+        self.max_cached_summaries = max_cached_summaries
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _message_tokens(self, message):
+        return count_tokens(message["content"], self.model) + MESSAGE_OVERHEAD_TOKENS
+
+    def _summary_for(self, messages):
+        # Rolling hash of every prefix, so the longest cached prefix can be extended
+        prefix_keys = []
+        digest = hashlib.sha256()
+        for message in messages:
+            digest.update(f"{message['role']}\x00{message['content']}\x00".encode("utf-8"))
+            prefix_keys.append(digest.copy().hexdigest())
+
+        with self._lock:
+            start, previous = 0, ""
+            for index in range(len(prefix_keys) - 1, -1, -1):
+                if prefix_keys[index] in self._summaries:
+                    start, previous = index + 1, self._summaries[prefix_keys[index]]
+                    self._summaries.move_to_end(prefix_keys[index])
+                    break
+        if start == len(messages):
+            return previous
+
+        summary = self.summarize(previous, messages[start:], self.summary_tokens)
+        with self._lock:
+            self._summaries[prefix_keys[-1]] = summary
+            while len(self._summaries) > self.max_cached_summaries:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def build(self, messages):
+        """Returns (window_messages, usage) for the next request.
+
+        usage reports the prompt tokens actually sent, the tokens the full
+        history would have cost and how many turns were summarized.
+        """
+        system = [m for m in messages[:1] if m["role"] == "system"]
+        turns = messages[len(system):]
+        full_tokens = sum(self._message_tokens(m) for m in messages)
+        if full_tokens <= self.token_budget:
+            return [_api_message(m) for m in messages], {
+                "input_tokens": full_tokens,
+                "full_tokens": full_tokens,
+                "summarized_messages": 0,
+            }
+
+        available = self.token_budget - sum(self._message_tokens(m) for m in system) - self.summary_tokens
+        kept, used = 0, 0
+        for message in reversed(turns):
+            cost = self._message_tokens(message)
+            if kept >= self.min_recent_messages and used + cost > available:
+                break
+            kept += 1
+            used += cost
+
+        older, recent = turns[:len(turns) - kept], turns[len(turns) - kept:]
+        window = [_api_message(m) for m in system]
+        if older:
+            summary = self._summary_for(older)
+            window.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        window.extend(_api_message(m) for m in recent)
+        return window, {
+            "input_tokens": sum(self._message_tokens(m) for m in window),
+            "full_tokens": full_tokens,
+            "summarized_messages": len(older),
+        }
@@ -0,0 +1,151 @@
+"""Immutable genre and content-type registry shared by cards and posters"""
+
+import re
+from collections import namedtuple
+from functools import lru_cache
+from types import MappingProxyType
+
+
+ContentType = namedtuple("ContentType", ["emoji", "dimensions"])
+
+# Poster colours as "BACKGROUND/TEXT" hex pairs
+GENRE_COLORS = MappingProxyType({
+    "action": "FF5733/FFFFFF",        # Orange background, white text
+    "adventure": "FF9900/FFFFFF",     # Dark orange background, white text
+    "romance": "FF9EF0/000000",       # Pink background, black text
+    "comedy": "FFEC33/000000",        # Yellow background, black text
+    "horror": "300030/FF0000",        # Dark purple background, red text
+    "fantasy": "33A1FF/FFFFFF",       # Blue background, white text
+    "sci-fi": "33FFB8/000000",        # Teal background, black text
+    "slice of life": "B8FF33/000000", # Light green background, black text
+    "sports": "FF3352/FFFFFF",        # Red background, white text
+    "mecha": "8F8F8F/FFFF00",         # Gray background, yellow text
+    "isekai": "9E33FF/FFFFFF",        # Purple background, white text
+    "mystery": "000066/FFFFFF",       # Dark blue background, white text
+    "psychological": "660066/FFFFFF", # Dark purple background, white text
+    "drama": "006666/FFFFFF",         # Dark teal background, white text
+    "supernatural": "663300/FFFFFF",  # Brown background, white text
+    "default": "3357FF/FFFFFF",       # Default blue background, white text
+})
+
+# Alternative spellings and sub-genres mapped onto GENRE_COLORS keys
+GENRE_ALIASES = MappingProxyType({
+    "science fiction": "sci-fi",
+    "sci fi": "sci-fi",
+    "scifi": "sci-fi",
+    "sf": "sci-fi",
+    "cyberpunk": "sci-fi",
+    "space opera": "sci-fi",
+    "shonen": "action",
+    "shounen": "action",
+    "shonen action": "action",
+    "martial arts": "action",
+    "battle": "action",
+    "seinen": "drama",
+    "josei": "drama",
+    "shojo": "romance",
+    "shoujo": "romance",
+    "romcom": "romance",
+    "rom-com": "romance",
+    "romantic comedy": "romance",
+    "slice-of-life": "slice of life",
+    "sol": "slice of life",
+    "iyashikei": "slice of life",
+    "gag": "comedy",
+    "parody": "comedy",
+    "dark fantasy": "fantasy",
+    "magic": "fantasy",
+    "high fantasy": "fantasy",
+    "reincarnation": "isekai",
+    "robot": "mecha",
+    "robots": "mecha",
+    "thriller": "psychological",
+    "psychological thriller": "psychological",
+    "detective": "mystery",
+    "suspense": "mystery",
+    "paranormal": "supernatural",
+    "ghost": "supernatural",
+    "yokai": "supernatural",
+    "sport": "sports",
+    "gore": "horror",
+})
+
+CONTENT_TYPES = MappingProxyType({
+    "anime": ContentType("📺", "300x450"),
+    "manga": ContentType("📚", "350x500"),
+    "movie": ContentType("🎬", "300x450"),
+    "light novel": ContentType("📘", "250x400"),
+    "default": ContentType("✨", "300x450"),
+})
+
+CONTENT_TYPE_ALIASES = MappingProxyType({
+    "tv": "anime",
+    "tv series": "anime",
+    "series": "anime",
+    "ova": "anime",
+    "ona": "anime",
+    "manhwa": "manga",
+    "manhua": "manga",
+    "webtoon": "manga",
+    "film": "movie",
+    "anime movie": "movie",
+    "anime film": "movie",
+    "light-novel": "light novel",
+    "ln": "light novel",
+    "novel": "light novel",
+})
+
+# Every spelling that resolves to a genre, longest first so "dark fantasy" wins over "fantasy"
+_GENRE_LOOKUP = MappingProxyType({**{name: name for name in GENRE_COLORS}, **GENRE_ALIASES})
+_GENRE_TERMS = tuple(sorted(_GENRE_LOOKUP, key=len, reverse=True))
+_PUNCTUATION = re.compile(r"[^a-z0-9' -]+")
+_CONTENT_TYPE_LOOKUP = MappingProxyType({**{name: name for name in CONTENT_TYPES}, **CONTENT_TYPE_ALIASES})
+
+
+def _clean(value):
+    return " ".join(value.lower().replace("_", " ").split())
+
+
+@lru_cache(maxsize=1024)
+def normalize_genre(genre):
+    """Maps free-form genre text such as "Sci-Fi" or "shonen action" to a GENRE_COLORS key"""
+    if not genre:
+        return "default"
+    cleaned = _clean(genre)
+    if cleaned in _GENRE_LOOKUP:
+        return _GENRE_LOOKUP[cleaned]
+    # "Action/Adventure" or "Fantasy, Romance": use the first recognised part
+    for part in cleaned.replace("/", ",").replace("&", ",").split(","):
+        part = part.strip()
+        if part in _GENRE_LOOKUP:
+            return _GENRE_LOOKUP[part]
+    padded = f" {cleaned} "
+    for term in _GENRE_TERMS:
+        if f" {term} " in padded:
+            return _GENRE_LOOKUP[term]
+    return "default"
+
+
+def find_genres(text):
+    """Returns the GENRE_COLORS keys of every genre mentioned in free text such as a chat message"""
+    padded = f" {' '.join(_PUNCTUATION.sub(' ', _clean(text)).split())} "
+    return {_GENRE_LOOKUP[term] for term in _GENRE_TERMS if f" {term} " in padded}
+
+
+@lru_cache(maxsize=256)
+def normalize_content_type(content_type):
+    """Maps free-form content type text such as "TV" or "Light Novel" to a CONTENT_TYPES key"""
+    if not content_type:
+        return "default"
+    cleaned = _clean(content_type)
+    return _CONTENT_TYPE_LOOKUP.get(cleaned, "default")
+
+
+def genre_colors(genre):
+    """Returns the poster colour pair for a genre"""
+    return GENRE_COLORS[normalize_genre(genre)]
+
+
+def content_type_info(content_type):
+    """Returns the emoji and poster dimensions for a content type"""
+    return CONTENT_TYPES[normalize_content_type(content_type)]
@@ -0,0 +1,211 @@
+"""LLM provider interface with an OpenAI implementation and a deterministic local fake"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+
+
+DEFAULT_FAKE_RECORDINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fake_completions.jsonl")
+
+
+class LLMBackend(ABC):
+    """Chat-completion operations the app relies on.
+
+    messages use the OpenAI chat format. options are passed through to the
+    provider (for example max_tokens). on_usage, when given, is called with
+    a {"prompt_tokens", "completion_tokens"} dict once usage is known.
+    """
+
+    @abstractmethod
+    def chat(self, messages, model, on_usage=None, **options):
+        """Returns the full completion text"""
+
+    @abstractmethod
+    def stream_chat(self, messages, model, on_usage=None, **options):
+        """Yields completion text deltas as they arrive"""
+
+    @abstractmethod
+    def structured(self, messages, model, response_format, on_usage=None, **options):
+        """Returns JSON text conforming to an OpenAI response_format schema"""
+
+    async def achat(self, messages, model, on_usage=None, **options):
+        """Async chat; options may include response_format"""
+        return await asyncio.to_thread(self.chat, messages, model, on_usage=on_usage, **options)
+
+
+def _report_usage(on_usage, usage):
+    if on_usage is not None and usage is not None:
+        on_usage({"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens})
+
+
+class OpenAIBackend(LLMBackend):
+    """Backend that calls the OpenAI chat completions API"""
+
+    def __init__(self, client, async_client=None):
+        self.client = client
+        self.async_client = async_client
+
+    def chat(self, messages, model, on_usage=None, **options):
+        completion = self.client.chat.completions.create(model=model, messages=messages, **options)
+        _report_usage(on_usage, completion.usage)
+        return completion.choices[0].message.content or ""
+
+    def stream_chat(self, messages, model, on_usage=None, **options):
+        if on_usage is not None:
+            # The final chunk then carries usage and no choices
+            options.setdefault("stream_options", {"include_usage": True})
+        stream = self.client.chat.completions.create(model=model, messages=messages, stream=True, **options)
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if getattr(chunk, "usage", None) is not None:
+                _report_usage(on_usage, chunk.usage)
+
+    def structured(self, messages, model, response_format, on_usage=None, **options):
+        return self.chat(messages, model, on_usage=on_usage, response_format=response_format, **options)
+
+    async def achat(self, messages, model, on_usage=None, **options):
+        if self.async_client is None:
+            return await super().achat(messages, model, on_usage=on_usage, **options)
+        completion = await self.async_client.chat.completions.create(model=model, messages=messages, **options)
+        _report_usage(on_usage, completion.usage)
+        return completion.choices[0].message.content or ""
+
+
+class FakeBackend(LLMBackend):
+    """Replays recorded completions locally with simulated latency.
+
+    Each recording is a dict with a "response" and optional "match" (a
+    substring of the system prompt) and "response_format" (the schema
+    name). The first recording that fits the request is replayed; one
+    without "match" acts as the fallback.
+
+    Time to first token is drawn from a log-normal distribution with the
+    given median and sigma. Text is then emitted at tokens_per_second,
+    treating every ~4 characters as one token. Pass a seed for repeatable
+    runs.
+    """
+
+    def __init__(self, recordings, tokens_per_second=60.0, first_token_median=0.4,
+                 first_token_sigma=0.5, characters_per_token=4, seed=None):
+        self.recordings = list(recordings)
+        self.tokens_per_second = tokens_per_second
+        self.first_token_median = first_token_median
+        self.first_token_sigma = first_token_sigma
+        self.characters_per_token = characters_per_token
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_jsonl(cls, path=DEFAULT_FAKE_RECORDINGS_PATH, **settings):
+        """Loads recordings from a JSON-lines file"""
+        with open(path, encoding="utf-8") as handle:
+            return cls((json.loads(line) for line in handle if line.strip()), **settings)
+
+    def _response_for(self, messages, response_format=None):
+        system_prompt = next((m["content"] for m in messages if m["role"] == "system"), "")
+        format_name = (response_format or {}).get("json_schema", {}).get("name")
+        fallback = None
+        for recording in self.recordings:
+            if recording.get("response_format") not in (None, format_name):
+                continue
+            if "match" not in recording:
+                fallback = fallback or recording
+            elif recording["match"] in system_prompt:
+                return recording["response"]
+        if fallback is None:
+            raise LookupError("No recorded completion matches this request")
+        return fallback["response"]
+
+    def _first_token_delay(self):
+        with self._lock:
+            return self._random.lognormvariate(math.log(self.first_token_median), self.first_token_sigma)
+
+    def _tokens(self, text):
+        step = self.characters_per_token
+        return [text[i:i + step] for i in range(0, len(text), step)]
+
+    def _generation_time(self, text):
+        return len(self._tokens(text)) / self.tokens_per_second
+
+    def _report_usage(self, on_usage, messages, text):
+        if on_usage is not None:
+            prompt_characters = sum(len(message["content"]) for message in messages)
+            on_usage({"prompt_tokens": -(-prompt_characters // self.characters_per_token),
+                      "completion_tokens": len(self._tokens(text))})
+
+    def chat(self, messages, model, on_usage=None, **options):
+        text = self._response_for(messages, options.get("response_format"))
+        time.sleep(self._first_token_delay() + self._generation_time(text))
+        self._report_usage(on_usage, messages, text)
+        return text
+
+    def stream_chat(self, messages, model, on_usage=None, **options):
+        text = self._response_for(messages, options.get("response_format"))
+        time.sleep(self._first_token_delay())
+        interval = 1 / self.tokens_per_second
+        for token in self._tokens(text):
+            yield token
+            time.sleep(interval)
+        self._report_usage(on_usage, messages, text)
+
+    def structured(self, messages, model, response_format, on_usage=None, **options):
+        return self.chat(messages, model, on_usage=on_usage, response_format=response_format, **options)
+
+    async def achat(self, messages, model, on_usage=None, **options):
+        text = self._response_for(messages, options.get("response_format"))
+        await asyncio.sleep(self._first_token_delay() + self._generation_time(text))
+        self._report_usage(on_usage, messages, text)
+        return text
+
+
+class InstrumentedBackend(LLMBackend):
+    """Wraps a backend to record request latency, time to first token, token usage and errors.
+
+    metrics is a metrics.Metrics registry; session, if given, is the
+    SessionMetrics the calls are attributed to.
+    """
+
+    def __init__(self, backend, metrics, session=None):
+        self.backend = backend
+        self.metrics = metrics
+        self.session = session
+
+    def _usage_recorder(self, model, on_usage):
+        def record(usage):
+            for kind in ("prompt", "completion"):
+                self.metrics.increment("llm_tokens_total", usage[f"{kind}_tokens"], self.session, model=model, kind=kind)
+            if on_usage is not None:
+                on_usage(usage)
+        return record
+
+    def chat(self, messages, model, on_usage=None, **options):
+        with self.metrics.timer("llm_request", self.session, model=model, operation="chat"):
+            return self.backend.chat(messages, model, on_usage=self._usage_recorder(model, on_usage), **options)
+
+    def stream_chat(self, messages, model, on_usage=None, **options):
+        with self.metrics.timer("llm_request", self.session, model=model, operation="stream"):
+            started = time.perf_counter()
+            first = True
+            for delta in self.backend.stream_chat(messages, model, on_usage=self._usage_recorder(model, on_usage),
+                                                  **options):
+                if first:
+                    self.metrics.observe("llm_first_token_seconds", time.perf_counter() - started, self.session,
+                                         model=model)
+                    first = False
+                yield delta
+
+    def structured(self, messages, model, response_format, on_usage=None, **options):
+        with self.metrics.timer("llm_request", self.session, model=model, operation="structured"):
+            return self.backend.structured(messages, model, response_format,
+                                           on_usage=self._usage_recorder(model, on_usage), **options)
+
+    async def achat(self, messages, model, on_usage=None, **options):
+        with self.metrics.timer("llm_request", self.session, model=model, operation="achat"):
+            return await self.backend.achat(messages, model, on_usage=self._usage_recorder(model, on_usage),
+                                            **options)
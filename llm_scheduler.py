@@ -0,0 +1,524 @@
+"""Process-wide admission control for model calls: rate limits, concurrency, coalescing and retries"""
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+
+from context_window import count_message_tokens
+from llm_backend import LLMBackend
+
+
+# Completion tokens reserved for a request without max_tokens, corrected once usage is reported
+DEFAULT_COMPLETION_TOKENS = 800
+
+
+class ModelBusyError(Exception):
+    """Raised when a request still fails after every retry; retry_after is a suggested wait in seconds.
+
+    partial_text holds what a stream produced before it broke off.
+    """
+
+    def __init__(self, message, retry_after=0.0, partial_text=""):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.partial_text = partial_text
+
+
+def is_retryable(error):
+    """True for rate limits (429), server errors (5xx), timeouts and dropped connections"""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, openai.APIConnectionError)
+
+
+def _wake(loop, future, result=None, error=None):
+    """Resolves an asyncio future from any thread; a closed loop has nobody left to wake"""
+    def resolve():
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    try:
+        loop.call_soon_threadsafe(resolve)
+    except RuntimeError:
+        pass
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+class TokenBucket:
+    """Refills at per_minute units per minute up to capacity.
+
+    Reservations are taken immediately and may overdraw the bucket; the
+    debt is how long the caller has to wait, so callers are served in the
+    order they reserved and the long-run rate never exceeds the quota.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self._level = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount):
+        """Takes amount and returns the seconds to wait before spending it"""
+        with self._lock:
+            self._refill()
+            self._level -= amount
+            return max(0.0, -self._level / self.rate)
+
+    def adjust(self, amount):
+        """Returns amount to the bucket, or takes more when it is negative"""
+        with self._lock:
+            self._refill()
+            self._level = min(self.capacity, self._level + amount)
+
+
+class _Flight:
+    """One in-flight request whose result, or streamed deltas, identical requests share"""
+
+    def __init__(self):
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self._condition = threading.Condition()
+        self._async_waiters = []
+
+    def add(self, chunk):
+        with self._condition:
+            self.chunks.append(chunk)
+            self._condition.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self._condition:
+            self.result = result
+            # A leader that was closed or interrupted leaves its followers nothing to share
+            self.error = error if error is None or isinstance(error, Exception) else \
+                ModelBusyError("The shared request was interrupted")
+            self.done = True
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            _wake(loop, future, self.result, self.error)
+
+    def wait(self):
+        with self._condition:
+            while not self.done:
+                self._condition.wait()
+            if self.error is not None:
+                raise self.error
+            return self.result
+
+    async def wait_async(self):
+        """Awaits the result on the running loop without holding a thread"""
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            if not self.done:
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            elif self.error is not None:
+                raise self.error
+            else:
+                return self.result
+        return await future
+
+    def iter_chunks(self):
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.chunks) and not self.done:
+                    self._condition.wait()
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    index += 1
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            yield chunk
+
+
+class RequestScheduler:
+    """Shares the provider quota between every session on this server.
+
+    A request first waits for one of max_concurrency slots, in arrival
+    order, then for its request and token budget from the RPM and TPM
+    token buckets (None means unlimited). Rate limits (429), server errors
+    and dropped connections are retried with full-jitter exponential
+    backoff, honouring Retry-After; a 429 also pauses new admissions for
+    the backoff so sessions do not keep hitting the limit together. A
+    request that is still failing after max_retries raises ModelBusyError,
+    as does a stream that breaks off after producing text.
+
+    Identical requests (same model, messages and options) made while one
+    is in flight wait for it and share its result instead of calling the
+    model again.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrency=16,
+                 max_retries=4, base_delay=1.0, max_delay=30.0, seed=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.admitted = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.failures = 0
+        self._condition = threading.Condition()
+        self._async_wakeups = []
+        self._active = 0
+        self._waiting = deque()
+        self._cooldown_until = 0.0
+        # Smoothed request duration, used to estimate how long a queued request will wait
+        self._average_seconds = 2.0
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    @staticmethod
+    def request_key(model, messages, options):
+        """Identifies requests that can share one completion"""
+        payload = json.dumps([model, messages, options], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _eta(self, position):
+        return math.ceil(position / self.max_concurrency) * self._average_seconds
+
+    def _notify_all(self):
+        # Called with the condition held; async waiters are woken on their own loops
+        self._condition.notify_all()
+        wakeups, self._async_wakeups = self._async_wakeups, []
+        for loop, future in wakeups:
+            _wake(loop, future)
+
+    def _take_slot(self, ticket):
+        # Called with the condition held
+        if self._active < self.max_concurrency and self._waiting[0] is ticket:
+            self._waiting.popleft()
+            self._active += 1
+            self.admitted += 1
+            self._notify_all()
+            return True
+        return False
+
+    def _leave_queue(self, ticket):
+        with self._condition:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+            self._notify_all()
+
+    def _rate_delay(self, cost):
+        delays = [self._cooldown_until - time.monotonic()]
+        if self.requests is not None:
+            delays.append(self.requests.reserve(1))
+        if self.tokens is not None:
+            delays.append(self.tokens.reserve(cost))
+        return max(0.0, *delays)
+
+    def admit(self, cost, on_wait=None):
+        """Blocks until a slot is free and returns the seconds still to wait for rate limits.
+
+        on_wait(position, eta_seconds) is called whenever the caller's place
+        in the queue changes. The caller must call release() afterwards.
+        """
+        ticket = object()
+        reported = None
+        with self._condition:
+            self._waiting.append(ticket)
+        try:
+            while True:
+                with self._condition:
+                    while True:
+                        if self._take_slot(ticket):
+                            status = None
+                            break
+                        position = self._waiting.index(ticket) + 1
+                        if on_wait is not None and position != reported:
+                            status = (position, self._eta(position))
+                            break
+                        self._condition.wait(0.5)
+                if status is None:
+                    break
+                # Reported outside the lock, since the callback may update the UI
+                reported = status[0]
+                on_wait(*status)
+        except BaseException:
+            self._leave_queue(ticket)
+            raise
+        return self._rate_delay(cost)
+
+    async def admit_async(self, cost):
+        """Awaits a slot in the same queue as admit() without holding a thread; returns the rate-limit wait"""
+        loop = asyncio.get_running_loop()
+        ticket = object()
+        with self._condition:
+            self._waiting.append(ticket)
+        try:
+            while True:
+                with self._condition:
+                    if self._take_slot(ticket):
+                        break
+                    wakeup = loop.create_future()
+                    self._async_wakeups.append((loop, wakeup))
+                # The timeout mirrors admit()'s polling in case a wakeup is ever missed
+                await asyncio.wait((wakeup,), timeout=0.5)
+        except BaseException:
+            self._leave_queue(ticket)
+            raise
+        return self._rate_delay(cost)
+
+    def release(self, seconds=None):
+        """Frees a slot taken by admit(); seconds is how long the request took"""
+        with self._condition:
+            self._active -= 1
+            if seconds is not None:
+                self._average_seconds = 0.8 * self._average_seconds + 0.2 * seconds
+            self._notify_all()
+
+    def correct_tokens(self, reserved, usage):
+        """Settles a token reservation against the usage the provider reported"""
+        if self.tokens is not None:
+            self.tokens.adjust(reserved - usage["prompt_tokens"] - usage["completion_tokens"])
+
+    def backoff(self, attempt, error):
+        """Returns the wait before the next attempt, pausing admissions when the provider rate limited us"""
+        delay = max(self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)), _retry_after(error))
+        with self._condition:
+            self.retries += 1
+            if isinstance(error, openai.RateLimitError):
+                self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+        return delay
+
+    def give_up(self, attempt, error):
+        """Returns None when error should be retried, otherwise the exception to raise in its place"""
+        if not is_retryable(error):
+            return error
+        if attempt < self.max_retries:
+            return None
+        with self._condition:
+            self.failures += 1
+        return ModelBusyError(f"The model is busy right now ({error})",
+                              retry_after=max(_retry_after(error), self.base_delay * 2 ** attempt))
+
+    def broke_off(self, error, partial_text):
+        """Returns the exception to raise for a stream that failed after producing text"""
+        if not isinstance(error, openai.APIError):
+            return error
+        with self._condition:
+            self.failures += 1
+        # The text already shown cannot be taken back, so the stream is not retried
+        return ModelBusyError(f"The model stopped mid-answer ({error})",
+                              retry_after=max(_retry_after(error), self.base_delay), partial_text=partial_text)
+
+    def flight(self, key):
+        """Returns (flight, leader): the shared flight for key and whether this caller must make the request"""
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def land(self, key, flight, result=None, error=None):
+        """Publishes a leader's outcome to its followers"""
+        with self._flights_lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(result, error)
+
+    def stats(self):
+        """Returns queue and retry counters for display or metrics"""
+        with self._condition:
+            return {
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "admitted": self.admitted,
+                "retries": self.retries,
+                "coalesced": self.coalesced,
+                "failures": self.failures,
+            }
+
+
+class ScheduledBackend(LLMBackend):
+    """Wraps a backend so its calls go through a shared RequestScheduler.
+
+    on_wait(position, eta_seconds) is called from the calling thread while a
+    request is queued (position 0 means it is waiting for rate limits or a
+    retry) and with position None once it is sent. Async calls run on a
+    background loop, so they queue without reporting.
+    """
+
+    def __init__(self, backend, scheduler, on_wait=None):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.on_wait = on_wait
+
+    def _notify(self, position, eta):
+        if self.on_wait is not None:
+            self.on_wait(position, eta)
+
+    def _cost(self, messages, options):
+        return count_message_tokens(messages) + (options.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+    def _usage_settler(self, cost, on_usage):
+        def settle(usage):
+            self.scheduler.correct_tokens(cost, usage)
+            if on_usage is not None:
+                on_usage(usage)
+        return settle
+
+    def _sleep(self, delay):
+        if delay > 0:
+            self._notify(0, delay)
+            time.sleep(delay)
+
+    @staticmethod
+    def _elapsed(started):
+        return time.monotonic() - started if started is not None else None
+
+    def _call(self, function, messages, model, on_usage, options, key_options=None):
+        # key_options, when given, identify the request for coalescing in place of options
+        key = self.scheduler.request_key(model, messages, options if key_options is None else key_options)
+        flight, leader = self.scheduler.flight(key)
+        if not leader:
+            return flight.wait()
+        cost = self._cost(messages, options)
+        attempt = 0
+        try:
+            while True:
+                delay = self.scheduler.admit(cost, self._notify)
+                # The slot is released however this attempt ends, including a Streamlit rerun raised from on_wait
+                started = None
+                try:
+                    self._sleep(delay)
+                    self._notify(None, 0.0)
+                    started = time.monotonic()
+                    try:
+                        result = function(messages, model, on_usage=self._usage_settler(cost, on_usage), **options)
+                    except Exception as error:
+                        failure = self.scheduler.give_up(attempt, error)
+                        if failure is not None:
+                            raise failure
+                        delay = self.scheduler.backoff(attempt, error)
+                        attempt += 1
+                    else:
+                        self.scheduler.land(key, flight, result=result)
+                        return result
+                finally:
+                    self.scheduler.release(self._elapsed(started))
+                self._sleep(delay)
+        except BaseException as error:
+            self.scheduler.land(key, flight, error=error)
+            raise
+
+    def chat(self, messages, model, on_usage=None, **options):
+        return self._call(self.backend.chat, messages, model, on_usage, options)
+
+    def structured(self, messages, model, response_format, on_usage=None, **options):
+        def structured(messages, model, on_usage=None, **options):
+            return self.backend.structured(messages, model, response_format, on_usage=on_usage, **options)
+        return self._call(structured, messages, model, on_usage, options,
+                          key_options={**options, "response_format": response_format})
+
+    def stream_chat(self, messages, model, on_usage=None, **options):
+        key = self.scheduler.request_key(model, messages, {**options, "stream": True})
+        flight, leader = self.scheduler.flight(key)
+        if not leader:
+            yield from flight.iter_chunks()
+            return
+        cost = self._cost(messages, options)
+        attempt = 0
+        try:
+            while True:
+                delay = self.scheduler.admit(cost, self._notify)
+                started = None
+                try:
+                    self._sleep(delay)
+                    self._notify(None, 0.0)
+                    started = time.monotonic()
+                    # Only a request that has not produced any text yet can be retried
+                    streamed = []
+                    try:
+                        for delta in self.backend.stream_chat(messages, model,
+                                                              on_usage=self._usage_settler(cost, on_usage), **options):
+                            streamed.append(delta)
+                            flight.add(delta)
+                            yield delta
+                    except Exception as error:
+                        if streamed:
+                            raise self.scheduler.broke_off(error, "".join(streamed)) from error
+                        failure = self.scheduler.give_up(attempt, error)
+                        if failure is not None:
+                            raise failure
+                        delay = self.scheduler.backoff(attempt, error)
+                        attempt += 1
+                    else:
+                        self.scheduler.land(key, flight)
+                        return
+                finally:
+                    self.scheduler.release(self._elapsed(started))
+                self._sleep(delay)
+        except BaseException as error:
+            self.scheduler.land(key, flight, error=error)
+            raise
+
+    async def achat(self, messages, model, on_usage=None, **options):
+        # Followers share the leader's flight; its result is awaited without blocking the loop
+        key = self.scheduler.request_key(model, messages, {**options, "async": True})
+        flight, leader = self.scheduler.flight(key)
+        if not leader:
+            return await flight.wait_async()
+        cost = self._cost(messages, options)
+        attempt = 0
+        try:
+            while True:
+                delay = await self.scheduler.admit_async(cost)
+                started = None
+                try:
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    started = time.monotonic()
+                    try:
+                        result = await self.backend.achat(messages, model,
+                                                          on_usage=self._usage_settler(cost, on_usage), **options)
+                    except Exception as error:
+                        failure = self.scheduler.give_up(attempt, error)
+                        if failure is not None:
+                            raise failure
+                        delay = self.scheduler.backoff(attempt, error)
+                        attempt += 1
+                    else:
+                        self.scheduler.land(key, flight, result=result)
+                        return result
+                finally:
+                    self.scheduler.release(self._elapsed(started))
+                await asyncio.sleep(delay)
+        except BaseException as error:
+            self.scheduler.land(key, flight, error=error)
+            raise
@@ -0,0 +1,205 @@
+"""Timings, counters and token usage exposed as Prometheus text or a JSON-lines log"""
+
+import json
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class SessionMetrics:
+    """Per-session totals, kept in st.session_state and shown in the debug sidebar"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.totals = {}
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "session", "labels", "started")
+
+    def __init__(self, metrics, name, session, labels):
+        self.metrics = metrics
+        self.name = name
+        self.session = session
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.metrics.observe(f"{self.name}_seconds", time.perf_counter() - self.started, self.session, **self.labels)
+        # GeneratorExit and KeyboardInterrupt are not failures of the timed work
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.metrics.increment("errors_total", 1, self.session, operation=self.name)
+        return False
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    pairs = [*label_key, *extra]
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metrics:
+    """Process-wide metric registry shared by every session.
+
+    Histograms and counters are keyed by name and labels. Gauges come from
+    collectors that are only called when metrics are rendered. Observations
+    can also update a SessionMetrics and are appended to log_path as JSON
+    lines when one is given.
+
+    With enabled=False every recording method returns immediately, and
+    timer() hands back a shared no-op context manager.
+    """
+
+    def __init__(self, enabled=True, log_path=None, buckets=DEFAULT_BUCKETS, prefix="animeverse_"):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = []
+        self._log = open(log_path, "a", encoding="utf-8", buffering=1) if enabled and log_path else None
+
+    def timer(self, name, session=None, **labels):
+        """Context manager recording the block's duration as {name}_seconds and its exceptions as errors_total"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, session, labels)
+
+    def observe(self, name, value, session=None, **labels):
+        """Adds a value to a histogram"""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # One count per bucket plus the overflow bucket, then the total count and sum
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0, 0.0]
+            histogram[bisect_left(self.buckets, value)] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+            if session is not None:
+                self._add_to_session(session, key, value)
+            self._write("observe", name, labels, value, session)
+
+    def increment(self, name, amount=1, session=None, **labels):
+        """Adds to a counter"""
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            if session is not None:
+                self._add_to_session(session, key, amount)
+            self._write("increment", name, labels, amount, session)
+
+    def add_collector(self, collect):
+        """Registers a function returning [(name, labels, value)] gauges, called at render time"""
+        self._collectors.append(collect)
+
+    def _add_to_session(self, session, key, value):
+        total = session.totals.setdefault(key[0] + _format_labels(key[1]), [0, 0.0])
+        total[0] += 1
+        total[1] += value
+
+    def _write(self, kind, name, labels, value, session):
+        if self._log is not None:
+            self._log.write(json.dumps({"ts": round(time.time(), 3), "type": kind, "name": name, "labels": labels,
+                                        "value": value, "session": session.id if session else None}) + "\n")
+
+    def _gauges(self):
+        for collect in self._collectors:
+            try:
+                yield from collect()
+            except Exception:
+                # A broken collector must not take the metrics endpoint down with it
+                continue
+
+    def render_prometheus(self):
+        """Returns every metric in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(values)) for key, values in self._histograms.items())
+        typed = set()
+        for (name, label_key), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {self.prefix}{name} counter")
+            lines.append(f"{self.prefix}{name}{_format_labels(label_key)} {value}")
+        for (name, label_key), values in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {self.prefix}{name} histogram")
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), values):
+                cumulative += count
+                lines.append(f"{self.prefix}{name}_bucket{_format_labels(label_key, (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{self.prefix}{name}_count{_format_labels(label_key)} {values[-2]}")
+            lines.append(f"{self.prefix}{name}_sum{_format_labels(label_key)} {values[-1]}")
+        for name, labels, value in self._gauges():
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {self.prefix}{name} gauge")
+            lines.append(f"{self.prefix}{name}{_format_labels(_label_key(labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Returns {metric: (count, total)} for histograms and counters, plus current gauges"""
+        with self._lock:
+            result = {name + _format_labels(label_key): (values[-2], values[-1])
+                      for (name, label_key), values in self._histograms.items()}
+            result.update({name + _format_labels(label_key): (None, value)
+                           for (name, label_key), value in self._counters.items()})
+        for name, labels, value in self._gauges():
+            result[name + _format_labels(_label_key(labels))] = (None, value)
+        return result
+
+
+def serve_prometheus(metrics, port, host="0.0.0.0"):
+    """Serves metrics.render_prometheus() at /metrics from a daemon thread; returns the server"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
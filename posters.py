@@ -0,0 +1,87 @@
+"""Local poster images for recommendation cards, rendered with Pillow"""
+
+import io
+import textwrap
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+
+# Fonts tried, in order, for drawing the content-type emoji
+EMOJI_FONT_PATHS = (
+    "/usr/share/fonts/truetype/noto/NotoColorEmoji.ttf",
+    "/usr/share/fonts/noto/NotoColorEmoji.ttf",
+    "/System/Library/Fonts/Apple Color Emoji.ttc",
+    "C:/Windows/Fonts/seguiemj.ttf",
+)
+
+
+@lru_cache(maxsize=16)
+def _font(size):
+    return ImageFont.load_default(size=size)
+
+
+@lru_cache(maxsize=1)
+def _emoji_font():
+    for path in EMOJI_FONT_PATHS:
+        try:
+            # Bitmap emoji fonts only load at their native size
+            return ImageFont.truetype(path, 109)
+        except OSError:
+            continue
+    return None
+
+
+def _parse_colors(colors):
+    background, text = colors.split("/")
+    return f"#{background}", f"#{text}"
+
+
+def _draw_centered(draw, center_x, top, text, font, fill, **kwargs):
+    left, upper, right, lower = draw.textbbox((0, 0), text, font=font, **kwargs)
+    draw.text((center_x - (right - left) / 2 - left, top - upper), text, font=font, fill=fill, **kwargs)
+    return lower - upper
+
+
+def _draw_badge(image, emoji, label, text_color, top):
+    """Draws the content-type emoji, or its label when no emoji font is installed"""
+    draw = ImageDraw.Draw(image)
+    width = image.width
+    emoji_font = _emoji_font()
+    if emoji_font is not None and emoji:
+        badge = Image.new("RGBA", (128, 128), (0, 0, 0, 0))
+        ImageDraw.Draw(badge).text((64, 64), emoji, font=emoji_font, anchor="mm", embedded_color=True)
+        size = width // 4
+        badge = badge.resize((size, size))
+        image.paste(badge, ((width - size) // 2, top), badge)
+        return size
+    return _draw_centered(draw, width / 2, top, label.upper(), _font(max(12, width // 16)), text_color)
+
+
+@lru_cache(maxsize=256)
+def render_poster(title, colors, emoji="", label="", dimensions="300x450", image_format="PNG"):
+    """Renders a poster placeholder and returns the encoded image bytes.
+
+    colors is a "BACKGROUND/TEXT" hex pair and dimensions a "WIDTHxHEIGHT"
+    string, matching the old placeholder-service URLs. Results are kept in a
+    bounded LRU cache, so repeated cards cost a dictionary lookup.
+    """
+    width, height = (int(part) for part in dimensions.lower().split("x"))
+    background, text_color = _parse_colors(colors)
+    image = Image.new("RGB", (width, height), background)
+    draw = ImageDraw.Draw(image)
+
+    margin = width // 12
+    draw.rectangle((margin // 2, margin // 2, width - margin // 2, height - margin // 2), outline=text_color, width=2)
+    top = height // 6
+    top += _draw_badge(image, emoji, label, text_color, top) + margin
+
+    font_size = max(14, width // 11)
+    chars_per_line = max(8, int((width - 2 * margin) / (font_size * 0.55)))
+    font = _font(font_size)
+    for line in textwrap.wrap(title, chars_per_line)[:6]:
+        top += _draw_centered(draw, width / 2, top, line, font, text_color) + font_size // 3
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format)
+    return buffer.getvalue()
@@ -0,0 +1,499 @@
+"""Offline recommendation precomputation for cache warming and nightly quality checks.
+
+Profiles are read as JSON lines, one per user:
+
+    {"id": "u1", "profile": {"username": "Kai", "favorite_anime": "Naruto, Mushishi",
+     "favorite_genres": "mecha", "experience_level": "Beginner", "content_type": "Anime only",
+     "content_length": "No preference"},
+     "messages": [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]}
+
+Each recommendations request is built exactly as app.py builds it, with the
+settings from .streamlit/secrets.toml (model, format, context budget and
+catalogue), so pages are stored under the cache keys the app looks up.
+
+    python precompute.py run profiles.jsonl --output pages.jsonl [--cache-path recommendations.db]
+    python precompute.py batch-requests profiles.jsonl --output batch_input.jsonl
+    python precompute.py batch-results profiles.jsonl batch_output.jsonl --output pages.jsonl
+    python precompute.py load pages.jsonl --cache-path recommendations.db
+
+run calls the model from a bounded worker pool behind the app's request
+scheduler. batch-requests writes the same requests in the OpenAI Batch API
+input format, and batch-results turns the downloaded batch output into pages.
+
+Output is JSON lines, or a directory of Parquet part files when --output ends
+in .parquet (requires pyarrow). The output is also the checkpoint: profiles
+already in it are skipped, so an interrupted run resumes where it stopped.
+The app expires cached pages after RECOMMENDATION_CACHE_TTL, so raise it when
+warming the cache ahead of time.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    import tomllib
+except ImportError:
+    # Python < 3.11; Streamlit depends on toml
+    import toml as tomllib
+
+from catalogue import DEFAULT_CATALOGUE_PATH, Catalogue
+from clients import build_async_openai_client, build_openai_client
+from context_window import ConversationWindow
+from llm_backend import DEFAULT_FAKE_RECORDINGS_PATH, FakeBackend, OpenAIBackend
+from llm_scheduler import RequestScheduler, ScheduledBackend
+from prompts import (RECOMMENDATIONS_MODEL, SECTION_PROMPTS, build_chat_system_prompt, build_recommendations_history,
+                     build_recommendations_messages, recommendations_system_prompt)
+from recommendation_cache import RecommendationCache, make_cache_key
+from recommendations import (CARD_SECTIONS, RECOMMENDATION_LIST_RESPONSE_FORMAT, RECOMMENDATIONS_RESPONSE_FORMAT,
+                             RecommendationPage, dump_recommendations, parse_recommendation_list, parse_recommendations)
+from section_generation import BackgroundLoop, iter_sections
+
+
+DEFAULT_SECRETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+
+# Setup answers for fields a profile leaves out, matching the app's initial values
+PROFILE_DEFAULTS = {
+    "username": "",
+    "favorite_anime": "",
+    "favorite_genres": "",
+    "experience_level": "Beginner",
+    "content_type": "Both anime and manga",
+    "content_length": "No preference",
+}
+
+
+def load_settings(path=DEFAULT_SECRETS_PATH):
+    """Reads the app's secrets.toml, or returns {} if there is none"""
+    try:
+        with open(path, encoding="utf-8") as handle:
+            return tomllib.loads(handle.read())
+    except FileNotFoundError:
+        return {}
+
+
+def read_profiles(path):
+    """Yields (id, profile, messages) for each line of a profiles file"""
+    with open(path, encoding="utf-8") as handle:
+        for number, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            profile = {**PROFILE_DEFAULTS, **record.get("profile", {})}
+            messages = [{"role": m["role"], "content": m["content"]} for m in record.get("messages", ())]
+            # Conversations open with the chat persona prompt, as they do in the app
+            if not messages or messages[0]["role"] != "system":
+                messages.insert(0, {"role": "system", "content": build_chat_system_prompt(profile)})
+            yield str(record.get("id", number)), profile, messages
+
+
+def build_backend(settings):
+    """Creates the backend the app would use: OpenAI, or the recorded-completion fake when LLM_BACKEND is "fake" """
+    if settings.get("LLM_BACKEND", "openai") == "fake":
+        fake_settings = dict(settings.get("FAKE_LLM", {}))
+        recordings_path = fake_settings.pop("recordings_path", DEFAULT_FAKE_RECORDINGS_PATH)
+        return FakeBackend.from_jsonl(recordings_path, **fake_settings)
+    api_key = settings.get("OPEN_API_KEY") or os.environ.get("OPENAI_API_KEY")
+    client_settings = dict(settings.get("OPENAI_CLIENT", {}))
+    client_settings.setdefault("max_retries", 0)
+    return OpenAIBackend(build_openai_client(api_key, client_settings),
+                         build_async_openai_client(api_key, client_settings))
+
+
+def _batch_content(outputs, custom_id):
+    result = outputs.get(custom_id)
+    if result is None:
+        raise LookupError(f"no batch result for {custom_id}")
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        raise RuntimeError(f"batch request {custom_id} failed: {result.get('error') or response.get('body')}")
+    body = response["body"]
+    return body["choices"][0]["message"]["content"] or "", body.get("usage")
+
+
+def _add_usage(total, usage):
+    if usage is not None:
+        for kind in ("prompt_tokens", "completion_tokens"):
+            total[kind] = total.get(kind, 0) + usage[kind]
+
+
+class Precomputer:
+    """Builds, sends and parses recommendations requests with the app's settings"""
+
+    def __init__(self, settings, backend=None):
+        self.model = settings.get("RECOMMENDATIONS_MODEL", RECOMMENDATIONS_MODEL)
+        self.format = settings.get("RECOMMENDATION_FORMAT", "ndjson")
+        self.system_prompt = recommendations_system_prompt(self.format)
+        self.window = ConversationWindow(
+            token_budget=settings.get("CONTEXT_TOKEN_BUDGET", 3000),
+            summary_tokens=settings.get("CONTEXT_SUMMARY_TOKENS", 400),
+        )
+        self.catalogue = Catalogue.load(settings.get("CATALOGUE_PATH", DEFAULT_CATALOGUE_PATH))
+        self.shortlist_size = settings.get("CATALOGUE_SHORTLIST_SIZE", 12)
+        # With local Hidden Gems the app never requests that section
+        local_hidden_gems = settings.get("HIDDEN_GEMS_SOURCE", "model") == "local"
+        self.sections = tuple(name for name in SECTION_PROMPTS if not (local_hidden_gems and name == "hidden_gems"))
+        self.backend = backend
+        self._background_loop = None
+
+    def prepare(self, profile_id, profile, messages):
+        """Returns the request for one profile: its id, cache key, transcript and messages"""
+        history = build_recommendations_history(messages, profile, self.window, self.catalogue, self.shortlist_size)
+        return {
+            "id": profile_id,
+            "cache_key": make_cache_key(history, self.system_prompt, self.model),
+            "history": history,
+            "messages": build_recommendations_messages(history, self.system_prompt),
+        }
+
+    def generate(self, request):
+        """Calls the model for one request and returns (text, usage); usage is None when not reported"""
+        usage = {}
+        if self.format == "sections":
+            if self._background_loop is None:
+                self._background_loop = BackgroundLoop()
+            page = RecommendationPage()
+            for section, value, error in iter_sections(self._background_loop, self.backend, request["history"],
+                                                       self.model, self.sections):
+                if error is not None:
+                    raise error
+                setattr(page, section, value)
+            return dump_recommendations(page), None
+        if self.format == "json":
+            text = self.backend.structured(request["messages"], self.model, RECOMMENDATIONS_RESPONSE_FORMAT,
+                                           on_usage=lambda reported: _add_usage(usage, reported))
+        else:
+            # The app streams these formats; the finished text is the same
+            text = self.backend.chat(request["messages"], self.model,
+                                     on_usage=lambda reported: _add_usage(usage, reported))
+        return text, usage or None
+
+    def batch_lines(self, request):
+        """Returns the OpenAI Batch API input lines for one request"""
+        if self.format != "sections":
+            options = {"response_format": RECOMMENDATIONS_RESPONSE_FORMAT} if self.format == "json" else {}
+            return [self._batch_line(request["id"], request["messages"], **options)]
+        lines = []
+        for section in self.sections:
+            system_prompt, max_tokens = SECTION_PROMPTS[section]
+            options = {"response_format": RECOMMENDATION_LIST_RESPONSE_FORMAT} if section in CARD_SECTIONS else {}
+            lines.append(self._batch_line(f"{request['id']}#{section}",
+                                          build_recommendations_messages(request["history"], system_prompt),
+                                          max_tokens=max_tokens, **options))
+        return lines
+
+    def _batch_line(self, custom_id, messages, **options):
+        return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                "body": {"model": self.model, "messages": messages, **options}}
+
+    def from_batch(self, request, outputs):
+        """Returns (text, usage) for a request from Batch API results keyed by custom_id"""
+        if self.format != "sections":
+            return _batch_content(outputs, request["id"])
+        page = RecommendationPage()
+        usage = {}
+        for section in self.sections:
+            content, section_usage = _batch_content(outputs, f"{request['id']}#{section}")
+            _add_usage(usage, section_usage)
+            setattr(page, section, parse_recommendation_list(content) if section in CARD_SECTIONS else content.strip())
+        return dump_recommendations(page), usage or None
+
+    def record(self, request, text, usage=None, seconds=None):
+        """Parses a page with the app's parser and returns its output record"""
+        page = parse_recommendations(text)
+        cards = page.top_recommendations + page.hidden_gems
+        return {
+            "id": request["id"],
+            "cache_key": request["cache_key"],
+            "model": self.model,
+            "format": self.format,
+            "text": text,
+            "page": json.loads(dump_recommendations(page)),
+            "cards": len(cards),
+            # Share of suggestions that exist in the catalogue, a cheap check for invented titles
+            "catalogue_matches": sum(1 for card in cards if self.catalogue.lookup(card.title) is not None),
+            "prompt_tokens": usage["prompt_tokens"] if usage else None,
+            "completion_tokens": usage["completion_tokens"] if usage else None,
+            "seconds": round(seconds, 3) if seconds is not None else None,
+            "created_at": round(time.time(), 3),
+        }
+
+
+class JsonlOutput:
+    """Appends records to a JSON-lines file; the records already in it are the checkpoint"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, "rb+") as handle:
+                data = handle.read()
+                # A run killed mid-write leaves a partial last line; drop it so that profile is redone
+                end = data.rfind(b"\n") + 1
+                handle.truncate(end)
+            self.done.update(json.loads(line)["id"] for line in data[:end].decode("utf-8").splitlines() if line.strip())
+        self._handle = open(path, "a", encoding="utf-8")
+
+    def write(self, record):
+        self._handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._handle.flush()
+
+    def close(self):
+        self._handle.close()
+
+    @staticmethod
+    def read(path):
+        with open(path, encoding="utf-8") as handle:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+    return pyarrow, pyarrow.parquet
+
+
+class ParquetOutput:
+    """Writes records as Parquet part files in a directory; the parts already there are the checkpoint.
+
+    Each part is written under a temporary name and renamed once complete,
+    so an interrupted run never leaves a truncated file, and loses at most
+    rows_per_part records. The page is stored as a JSON string.
+    """
+
+    def __init__(self, path, rows_per_part=100):
+        pyarrow, self._parquet = _import_pyarrow()
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self.schema = pyarrow.schema([
+            ("id", pyarrow.string()), ("cache_key", pyarrow.string()), ("model", pyarrow.string()),
+            ("format", pyarrow.string()), ("text", pyarrow.string()), ("page", pyarrow.string()),
+            ("cards", pyarrow.int64()), ("catalogue_matches", pyarrow.int64()), ("prompt_tokens", pyarrow.int64()),
+            ("completion_tokens", pyarrow.int64()), ("seconds", pyarrow.float64()), ("created_at", pyarrow.float64()),
+        ])
+        self._table = pyarrow.Table
+        os.makedirs(path, exist_ok=True)
+        self.done = set()
+        for name in self._parts(path):
+            self.done.update(self._parquet.read_table(name, columns=["id"]).column("id").to_pylist())
+        self._run = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self._written = 0
+        self._rows = []
+
+    @staticmethod
+    def _parts(path):
+        return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".parquet")]
+
+    def write(self, record):
+        self._rows.append({**record, "page": json.dumps(record["page"], ensure_ascii=False)})
+        if len(self._rows) >= self.rows_per_part:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        name = os.path.join(self.path, f"part-{self._run}-{self._written:05d}.parquet")
+        self._parquet.write_table(self._table.from_pylist(self._rows, schema=self.schema), name + ".tmp")
+        os.replace(name + ".tmp", name)
+        self._written += 1
+        self._rows = []
+
+    def close(self):
+        self._flush()
+
+    @classmethod
+    def read(cls, path):
+        _, parquet = _import_pyarrow()
+        for name in cls._parts(path):
+            for row in parquet.read_table(name).to_pylist():
+                yield {**row, "page": json.loads(row["page"])}
+
+
+def open_output(path, rows_per_part=100):
+    """Opens an output for appending: Parquet part files for a .parquet path, JSON lines otherwise"""
+    return ParquetOutput(path, rows_per_part) if path.endswith(".parquet") else JsonlOutput(path)
+
+
+def read_output(path):
+    """Yields the records of a precompute output"""
+    return ParquetOutput.read(path) if path.endswith(".parquet") else JsonlOutput.read(path)
+
+
+def open_cache(path, settings):
+    """Opens the app's SQLite recommendation cache, or returns None without a path"""
+    if not path:
+        return None
+    return RecommendationCache(
+        max_entries=settings.get("RECOMMENDATION_CACHE_SIZE", 256),
+        ttl_seconds=settings.get("RECOMMENDATION_CACHE_TTL", 3600),
+        db_path=path,
+    )
+
+
+def _generate(precomputer, request):
+    started = time.perf_counter()
+    try:
+        text, usage = precomputer.generate(request)
+        return request, precomputer.record(request, text, usage, time.perf_counter() - started), None
+    except Exception as error:
+        return request, None, error
+
+
+def command_run(args, settings):
+    scheduler = RequestScheduler(**dict(settings.get("LLM_SCHEDULER", {})))
+    precomputer = Precomputer(settings, ScheduledBackend(build_backend(settings), scheduler))
+    workers = args.workers or scheduler.max_concurrency
+    output = open_output(args.output, args.rows_per_part)
+    cache = open_cache(args.cache_path or settings.get("RECOMMENDATION_CACHE_PATH"), settings)
+    skipped, written, failed = 0, 0, 0
+    started = time.perf_counter()
+
+    def finish(futures):
+        nonlocal written, failed
+        records = []
+        for future in futures:
+            request, record, error = future.result()
+            if error is not None:
+                failed += 1
+                print(f"{request['id']}: {type(error).__name__}: {error}", file=sys.stderr)
+                continue
+            output.write(record)
+            records.append(record)
+        if cache is not None and records:
+            cache.set_many((record["cache_key"], record["text"]) for record in records)
+        written += len(records)
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="precompute")
+    try:
+        pending = set()
+        for profile_id, profile, messages in read_profiles(args.profiles):
+            if profile_id in output.done:
+                skipped += 1
+                continue
+            # Keeps memory flat for large inputs: only a couple of requests per worker are queued
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                finish(done)
+            pending.add(pool.submit(_generate, precomputer, precomputer.prepare(profile_id, profile, messages)))
+        finish(wait(pending).done)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        output.close()
+    stats = scheduler.stats()
+    print(f"{written} pages written, {skipped} already done, {failed} failed in {time.perf_counter() - started:.1f}s "
+          f"({stats['retries']} retries, {stats['coalesced']} coalesced)")
+    return 1 if failed else 0
+
+
+def command_batch_requests(args, settings):
+    precomputer = Precomputer(settings)
+    done = {record["id"] for record in read_output(args.done)} if args.done else set()
+    count = 0
+    with open(args.output, "w", encoding="utf-8") as handle:
+        for profile_id, profile, messages in read_profiles(args.profiles):
+            if profile_id in done:
+                continue
+            for line in precomputer.batch_lines(precomputer.prepare(profile_id, profile, messages)):
+                handle.write(json.dumps(line, ensure_ascii=False) + "\n")
+                count += 1
+    print(f"{count} batch requests written to {args.output}")
+    return 0
+
+
+def command_batch_results(args, settings):
+    precomputer = Precomputer(settings)
+    with open(args.results, encoding="utf-8") as handle:
+        outputs = {result["custom_id"]: result for result in map(json.loads, filter(str.strip, handle))}
+    output = open_output(args.output, args.rows_per_part)
+    cache = open_cache(args.cache_path or settings.get("RECOMMENDATION_CACHE_PATH"), settings)
+    written, failed = 0, 0
+    try:
+        for profile_id, profile, messages in read_profiles(args.profiles):
+            if profile_id in output.done:
+                continue
+            request = precomputer.prepare(profile_id, profile, messages)
+            try:
+                record = precomputer.record(request, *precomputer.from_batch(request, outputs))
+            except Exception as error:
+                failed += 1
+                print(f"{profile_id}: {type(error).__name__}: {error}", file=sys.stderr)
+                continue
+            output.write(record)
+            if cache is not None:
+                cache.set(record["cache_key"], record["text"])
+            written += 1
+    finally:
+        output.close()
+    print(f"{written} pages written, {failed} failed")
+    return 1 if failed else 0
+
+
+def command_load(args, settings):
+    cache = open_cache(args.cache_path or settings.get("RECOMMENDATION_CACHE_PATH"), settings)
+    if cache is None:
+        raise SystemExit("No cache to load into: pass --cache-path or set RECOMMENDATION_CACHE_PATH")
+    count = 0
+    batch = []
+    for record in read_output(args.pages):
+        batch.append((record["cache_key"], record["text"]))
+        if len(batch) >= 1000:
+            cache.set_many(batch)
+            count += len(batch)
+            batch = []
+    cache.set_many(batch)
+    count += len(batch)
+    print(f"{count} pages loaded into {args.cache_path or settings.get('RECOMMENDATION_CACHE_PATH')}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--secrets", default=DEFAULT_SECRETS_PATH, help="app settings to build requests with")
+    parser.add_argument("--fake", action="store_true", help="replay recorded completions instead of calling OpenAI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="generate pages with a bounded worker pool")
+    run.add_argument("profiles")
+    run.add_argument("--output", required=True, help=".jsonl file or .parquet directory; resumed if it exists")
+    run.add_argument("--workers", type=int, help="concurrent requests (default: the scheduler's max_concurrency)")
+    run.add_argument("--cache-path", help="SQLite recommendation cache to fill (default: RECOMMENDATION_CACHE_PATH)")
+    run.add_argument("--rows-per-part", type=int, default=100, help="records per Parquet part file")
+    run.set_defaults(handler=command_run)
+
+    batch_requests = commands.add_parser("batch-requests", help="write OpenAI Batch API input")
+    batch_requests.add_argument("profiles")
+    batch_requests.add_argument("--output", required=True)
+    batch_requests.add_argument("--done", help="earlier output whose profiles are skipped")
+    batch_requests.set_defaults(handler=command_batch_requests)
+
+    batch_results = commands.add_parser("batch-results", help="turn OpenAI Batch API output into pages")
+    batch_results.add_argument("profiles")
+    batch_results.add_argument("results")
+    batch_results.add_argument("--output", required=True, help=".jsonl file or .parquet directory; resumed if it exists")
+    batch_results.add_argument("--cache-path", help="SQLite recommendation cache to fill (default: RECOMMENDATION_CACHE_PATH)")
+    batch_results.add_argument("--rows-per-part", type=int, default=100, help="records per Parquet part file")
+    batch_results.set_defaults(handler=command_batch_results)
+
+    load = commands.add_parser("load", help="load earlier output into the recommendation cache")
+    load.add_argument("pages")
+    load.add_argument("--cache-path", help="SQLite recommendation cache (default: RECOMMENDATION_CACHE_PATH)")
+    load.set_defaults(handler=command_load)
+
+    args = parser.parse_args()
+    settings = load_settings(args.secrets)
+    if args.fake:
+        settings["LLM_BACKEND"] = "fake"
+    return args.handler(args, settings)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Prompt construction shared by the Streamlit app and offline tooling"""
+
+
+RECOMMENDATIONS_MODEL = "gpt-4o"
+
+RECOMMENDATIONS_SYSTEM_PROMPT = """You are an anime and manga recommendation specialist.
+             Based on the conversation, provide a personalized list of recommendations in JSON compatible format.
+             For each recommendation include:
+             - title: Full title of the anime/manga
+             - year: Release year (if known)
+             - genre: Primary genre (e.g., action, romance, fantasy)
+             - content_type: Either "anime", "manga", "movie", or "light novel"
+             - description: Brief description (1-2 sentences)
+             - appeal: Why they'll love it based on their preferences
+
+             Format your response with clear section headings and organize as follows:
+
+             ## Overall Theme
+             [Brief description of what you think the user will enjoy]
+
+             ## Top Recommendations
+             [List 5 recommendations with complete details for each]
+
+             ## Hidden Gems
+             [List 3 lesser-known recommendations with complete details for each]
+
+             ## Where to Watch/Read
+             [General information about legal platforms for anime/manga]
+             """
+
+RECOMMENDATIONS_JSON_SYSTEM_PROMPT = """You are an anime and manga recommendation specialist.
+             Based on the conversation, provide a personalized list of recommendations as a JSON object.
+             For each recommendation include:
+             - title: Full title of the anime/manga
+             - year: Release year, or an empty string if unknown
+             - genre: Primary genre (e.g., action, romance, fantasy)
+             - content_type: Either "anime", "manga", "movie", or "light novel"
+             - description: Brief description (1-2 sentences)
+             - appeal: Why they'll love it based on their preferences
+
+             Fill the object as follows:
+             - overall_theme: Brief description of what you think the user will enjoy
+             - top_recommendations: 5 recommendations
+             - hidden_gems: 3 lesser-known recommendations
+             - where_to_watch: General information about legal platforms for anime/manga
+             """
+
+RECOMMENDATIONS_NDJSON_SYSTEM_PROMPT = """You are an anime and manga recommendation specialist.
+             Based on the conversation, provide a personalized list of recommendations.
+             Respond with one JSON object per line and nothing else: no code fences, no blank lines, no commentary.
+             Write the lines in this order:
+
+             {"section": "overall_theme", "text": "<brief description of what you think the user will enjoy>"}
+             Then 5 lines with "section": "top_recommendations"
+             Then 3 lesser-known recommendations with "section": "hidden_gems"
+             {"section": "where_to_watch", "text": "<general information about legal platforms for anime/manga>"}
+
+             Each recommendation line must include:
+             - title: Full title of the anime/manga
+             - year: Release year, or an empty string if unknown
+             - genre: Primary genre (e.g., action, romance, fantasy)
+             - content_type: Either "anime", "manga", "movie", or "light novel"
+             - description: Brief description (1-2 sentences)
+             - appeal: Why they'll love it based on their preferences
+             """
+
+_SECTION_PREAMBLE = """You are an anime and manga recommendation specialist.
+             Based on the conversation, """
+
+_RECOMMENDATION_FIELDS = """
+             For each recommendation include:
+             - title: Full title of the anime/manga
+             - year: Release year, or an empty string if unknown
+             - genre: Primary genre (e.g., action, romance, fantasy)
+             - content_type: Either "anime", "manga", "movie", or "light novel"
+             - description: Brief description (1-2 sentences)
+             - appeal: Why they'll love it based on their preferences
+             """
+
+# Per-section prompts and output limits for concurrent section generation
+SECTION_PROMPTS = {
+    "overall_theme": (
+        _SECTION_PREAMBLE + "write a brief description (2-3 sentences) of what you think the user will enjoy. Reply with plain text only.",
+        200,
+    ),
+    "top_recommendations": (
+        _SECTION_PREAMBLE + "list 5 personalized recommendations as a JSON object." + _RECOMMENDATION_FIELDS,
+        1200,
+    ),
+    "hidden_gems": (
+        _SECTION_PREAMBLE + "list 3 lesser-known recommendations as a JSON object. Avoid the most popular titles." + _RECOMMENDATION_FIELDS,
+        800,
+    ),
+    "where_to_watch": (
+        _SECTION_PREAMBLE + "give general information about legal platforms where they can watch or read what they like. Reply with plain text only.",
+        300,
+    ),
+}
+
+
+def build_chat_system_prompt(profile):
+    """Creates the chat persona prompt from the user's setup answers"""
+    return (f"You are AnimeVerse Guide, an enthusiastic and knowledgeable anime and manga recommendation assistant. "
+            f"You're helping {profile['username']} find new anime and manga to enjoy. "
+            f"They enjoy {profile['favorite_anime']} and prefer genres like {profile['favorite_genres']}. "
+            f"Their experience level is {profile['experience_level']}, they're looking for {profile['content_type']}, "
+            f"and prefer {profile['content_length']} content. "
+            f"Engage in a friendly conversation about anime and manga, using occasional Japanese terms (with translations), "
+            f"and references to popular anime. Ask about their preferences to provide personalized recommendations. "
+            f"Be enthusiastic but not overwhelming. Provide specific recommendations with brief descriptions. "
+            f"Avoid any inappropriate or adult-only content in your recommendations.")
+
+
+def format_conversation_history(messages):
+    """Flattens chat messages into the transcript sent to the recommendations model"""
+    return "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
+
+
+def format_catalogue_candidates(entries):
+    """Describes catalogue shortlist entries for the recommendations prompt"""
+    if not entries:
+        return ""
+    lines = []
+    for entry in entries:
+        length = f"{entry.episodes} episodes" if entry.episodes else f"{entry.volumes} volumes" if entry.volumes else ""
+        details = ", ".join(str(part) for part in (entry.year, entry.content_type, length, "/".join(entry.genres)) if part)
+        lines.append(f"- {entry.title} ({details})")
+    return ("\n\nCandidate titles from our catalogue that match this profile "
+            "(prefer these when they fit, and use their exact titles):\n" + "\n".join(lines))
+
+
+def build_recommendations_messages(conversation_history, system_prompt=RECOMMENDATIONS_SYSTEM_PROMPT):
+    """Creates the message list for a recommendations completion"""
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"Here's my conversation with AnimeVerse Guide. Please provide personalized recommendations based on this: {conversation_history}"}
+    ]
+
+
+def recommendations_system_prompt(recommendation_format):
+    """Returns the system prompt for a RECOMMENDATION_FORMAT: "ndjson" (default), "markdown", "json" or "sections" """
+    return {
+        "json": RECOMMENDATIONS_JSON_SYSTEM_PROMPT,
+        "markdown": RECOMMENDATIONS_SYSTEM_PROMPT,
+        "sections": "\n".join(prompt for prompt, _ in SECTION_PROMPTS.values()),
+    }.get(recommendation_format, RECOMMENDATIONS_NDJSON_SYSTEM_PROMPT)
+
+
+def build_recommendations_history(messages, profile, window, catalogue, shortlist_size=12):
+    """Creates the transcript sent for recommendations: the chat fitted to the window plus a catalogue shortlist.
+
+    window is a ConversationWindow and catalogue a Catalogue, so the app and
+    offline tools produce identical prompts (and cache keys) for one profile.
+    """
+    window_messages, _ = window.build(messages)
+    # A local catalogue shortlist grounds the model in real titles and shortens its answer
+    return format_conversation_history(window_messages) + format_catalogue_candidates(catalogue.shortlist(
+        profile["favorite_anime"],
+        profile["favorite_genres"],
+        profile["content_type"],
+        profile["content_length"],
+        limit=shortlist_size,
+    ))
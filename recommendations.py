@@ -0,0 +1,350 @@
+"""Typed recommendation results and the parsers that produce them"""
+
+import json
+import re
+from dataclasses import asdict, dataclass, field
+
+
+@dataclass(slots=True)
+class Recommendation:
+    """A single anime/manga recommendation ready to render as a card"""
+    title: str
+    year: str = ""
+    genre: str = ""
+    content_type: str = "anime"
+    description: str = ""
+    appeal: str = ""
+
+
+@dataclass(slots=True)
+class RecommendationPage:
+    """All sections of a recommendations response"""
+    overall_theme: str = ""
+    top_recommendations: list = field(default_factory=list)
+    hidden_gems: list = field(default_factory=list)
+    where_to_watch: str = ""
+
+
+_RECOMMENDATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "year": {"type": "string"},
+        "genre": {"type": "string"},
+        "content_type": {"type": "string", "enum": ["anime", "manga", "movie", "light novel"]},
+        "description": {"type": "string"},
+        "appeal": {"type": "string"},
+    },
+    "required": ["title", "year", "genre", "content_type", "description", "appeal"],
+    "additionalProperties": False,
+}
+
+# OpenAI structured-output format matching RecommendationPage
+RECOMMENDATIONS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "anime_recommendations",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "overall_theme": {"type": "string"},
+                "top_recommendations": {"type": "array", "items": _RECOMMENDATION_SCHEMA},
+                "hidden_gems": {"type": "array", "items": _RECOMMENDATION_SCHEMA},
+                "where_to_watch": {"type": "string"},
+            },
+            "required": ["overall_theme", "top_recommendations", "hidden_gems", "where_to_watch"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Structured-output format for a single card section
+RECOMMENDATION_LIST_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "anime_recommendation_list",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "recommendations": {"type": "array", "items": _RECOMMENDATION_SCHEMA},
+            },
+            "required": ["recommendations"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def recommendation_from_dict(data):
+    """Builds a Recommendation from a decoded JSON object, or None if it has no title"""
+    if not isinstance(data, dict):
+        return None
+    title = str(data.get("title") or "").strip()
+    if not title:
+        return None
+    year = data.get("year")
+    return Recommendation(
+        title=title,
+        year=str(year).strip() if year else "",
+        genre=str(data.get("genre") or "").strip(),
+        content_type=str(data.get("content_type") or "anime").strip(),
+        description=str(data.get("description") or "").strip(),
+        appeal=str(data.get("appeal") or "").strip(),
+    )
+
+
+def parse_json_recommendations(text):
+    """Parses a structured-output response; raises ValueError if it isn't valid JSON"""
+    data = json.loads(text)
+    if not isinstance(data, dict):
+        raise ValueError("Recommendations response is not a JSON object")
+    page = RecommendationPage(
+        overall_theme=str(data.get("overall_theme") or "").strip(),
+        where_to_watch=str(data.get("where_to_watch") or "").strip(),
+    )
+    for key, target in (("top_recommendations", page.top_recommendations), ("hidden_gems", page.hidden_gems)):
+        for item in data.get(key) or ():
+            recommendation = recommendation_from_dict(item)
+            if recommendation is not None:
+                target.append(recommendation)
+    return page
+
+
+def parse_recommendation_list(text):
+    """Parses a single card section produced with RECOMMENDATION_LIST_RESPONSE_FORMAT"""
+    data = json.loads(text)
+    items = data.get("recommendations") if isinstance(data, dict) else data
+    recommendations = []
+    for item in items or ():
+        recommendation = recommendation_from_dict(item)
+        if recommendation is not None:
+            recommendations.append(recommendation)
+    return recommendations
+
+
+def dump_recommendations(page):
+    """Serializes a page in the structured-output format read by parse_recommendations"""
+    return json.dumps(asdict(page), ensure_ascii=False)
+
+
+# One alternation per line kind, so each markdown line is classified by a single match
+_MARKDOWN_LINE = re.compile(
+    r"^[ \t]*(?:"
+    r"#{2,}[ \t]*(?P<heading>.+?)"
+    r"|(?:[-*][ \t]+)?\**(?P<field>title|year|genre|content[ _]type|type|description|appeal|why (?:they'll|you'll) love it)\**[ \t]*:\**[ \t]*(?P<value>.*?)"
+    r"|\d+[.)][ \t]+(?P<item>.+?)"
+    r"|(?P<text>\S.*?)"
+    r")[ \t]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_TITLE_YEAR = re.compile(r"^(?P<title>.+?)\s*\((?P<year>[^)]*)\)")
+_NUMBERED_HEADING = re.compile(r"^\**\d+[.)][ \t]+(?P<item>.+)$")
+
+# Display headings for each RecommendationPage section, in page order
+SECTION_TITLES = {
+    "overall_theme": "Overall Theme",
+    "top_recommendations": "Top Recommendations",
+    "hidden_gems": "Hidden Gems",
+    "where_to_watch": "Where to Watch/Read",
+}
+_SECTIONS = {
+    "overall theme": "overall_theme",
+    "top recommendations": "top_recommendations",
+    "hidden gems": "hidden_gems",
+    "where to watch/read": "where_to_watch",
+}
+CARD_SECTIONS = ("top_recommendations", "hidden_gems")
+PROSE_SECTIONS = ("overall_theme", "where_to_watch")
+_FIELD_NAMES = {
+    "content type": "content_type",
+    "content_type": "content_type",
+    "type": "content_type",
+    "why they'll love it": "appeal",
+    "why you'll love it": "appeal",
+}
+
+
+def _split_title(text):
+    text = text.replace("**", "").strip()
+    if text.lower().startswith("title:"):
+        text = text[6:].strip()
+    if " - " in text:
+        text = text.split(" - ", 1)[0].strip()
+    match = _TITLE_YEAR.match(text)
+    if match:
+        return match.group("title").strip(), match.group("year").strip()
+    return text, ""
+
+
+class _MarkdownState:
+    """Line-by-line state machine for the free-form '## Section' markdown layout"""
+
+    def __init__(self, page, events):
+        self.page = page
+        self.events = events
+        self.section = None
+        self.current = None
+        self.extra = []
+        self.prose = []
+
+    def _finish_item(self):
+        current, extra = self.current, self.extra
+        self.current, self.extra = None, []
+        if current is None or not current.title:
+            return
+        if not current.description and extra:
+            current.description = " ".join(extra)
+        getattr(self.page, self.section).append(current)
+        self.events.append((self.section, current))
+
+    def _finish_section(self):
+        if self.section in CARD_SECTIONS:
+            self._finish_item()
+        elif self.section in PROSE_SECTIONS and self.prose:
+            text = "\n".join(self.prose)
+            setattr(self.page, self.section, text)
+            self.events.append((self.section, text))
+        self.prose = []
+
+    def consume(self, match):
+        heading = match.group("heading")
+        item = match.group("item")
+        if heading is not None:
+            section = _SECTIONS.get(heading.replace("*", "").strip().lower())
+            numbered = _NUMBERED_HEADING.match(heading)
+            if section is None and numbered and self.section in CARD_SECTIONS:
+                # "### 1. **Title** (2013)" is a card inside the current section, not a new section
+                item = numbered.group("item")
+            else:
+                self._finish_section()
+                self.section = section
+                return
+
+        if self.section in PROSE_SECTIONS:
+            self.prose.append(match.group(0).strip())
+            return
+        if self.section is None:
+            return
+
+        name = match.group("field")
+        if item is not None:
+            self._finish_item()
+            title, year = _split_title(item)
+            self.current = Recommendation(title=title, year=year)
+        elif name is not None:
+            name = name.lower()
+            name = _FIELD_NAMES.get(name, name)
+            value = match.group("value").replace("**", "").strip()
+            if name == "title":
+                if self.current is not None and self.current.title:
+                    self._finish_item()
+                title, year = _split_title(value)
+                self.current = Recommendation(title=title, year=year)
+            elif self.current is not None:
+                setattr(self.current, name, value)
+        elif self.current is not None:
+            self.extra.append(match.group("text"))
+
+    def close(self):
+        self._finish_section()
+        self.section = None
+
+
+def parse_recommendations(text):
+    """Parses a recommendations response in any of the supported formats"""
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        stripped = stripped.strip("`")
+        if stripped.lower().startswith("json"):
+            stripped = stripped[4:]
+    try:
+        return parse_json_recommendations(stripped)
+    except ValueError:
+        pass
+    # Newline-delimited JSON and markdown both go through the line parser
+    parser = RecommendationStreamParser()
+    parser.feed(text)
+    parser.close()
+    return parser.page
+
+
+def iter_page_events(page):
+    """Yields (section, value) pairs for a parsed page in display order"""
+    if page.overall_theme:
+        yield "overall_theme", page.overall_theme
+    for recommendation in page.top_recommendations:
+        yield "top_recommendations", recommendation
+    for recommendation in page.hidden_gems:
+        yield "hidden_gems", recommendation
+    if page.where_to_watch:
+        yield "where_to_watch", page.where_to_watch
+
+
+class RecommendationStreamParser:
+    """Incremental parser for a streamed recommendations response.
+
+    Text deltas are fed in as they arrive; each call returns the
+    (section, value) events completed so far, where value is a
+    Recommendation for card sections and a string for prose sections.
+    Lines holding a JSON object (the newline-delimited format) are decoded
+    directly, anything else goes through the markdown state machine.
+    """
+
+    def __init__(self):
+        self.page = RecommendationPage()
+        self._events = []
+        self._markdown = _MarkdownState(self.page, self._events)
+        self._buffer = ""
+
+    def _consume_json(self, line):
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return False
+        if not isinstance(data, dict):
+            return False
+        section = data.get("section")
+        if section in CARD_SECTIONS:
+            recommendation = recommendation_from_dict(data)
+            if recommendation is not None:
+                getattr(self.page, section).append(recommendation)
+                self._events.append((section, recommendation))
+        elif section in PROSE_SECTIONS:
+            text = str(data.get("text") or "").strip()
+            if text:
+                setattr(self.page, section, text)
+                self._events.append((section, text))
+        return True
+
+    def _consume_line(self, line):
+        stripped = line.strip()
+        if not stripped or stripped.startswith("```"):
+            return
+        if stripped.startswith("{") and self._consume_json(stripped):
+            return
+        match = _MARKDOWN_LINE.match(line)
+        if match:
+            self._markdown.consume(match)
+
+    def _drain(self):
+        events = self._events[:]
+        self._events.clear()
+        return events
+
+    def feed(self, text):
+        """Adds a text delta and returns the events it completed"""
+        self._buffer += text
+        if "\n" in text:
+            *lines, self._buffer = self._buffer.split("\n")
+            for line in lines:
+                self._consume_line(line)
+        return self._drain()
+
+    def close(self):
+        """Flushes the trailing line and any open section"""
+        self._consume_line(self._buffer)
+        self._buffer = ""
+        self._markdown.close()
+        return self._drain()
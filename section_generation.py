@@ -0,0 +1,73 @@
+"""Concurrent generation of the recommendations page, one request per section"""
+
+import asyncio
+import queue
+import threading
+
+from prompts import SECTION_PROMPTS, build_recommendations_messages
+from recommendations import CARD_SECTIONS, RECOMMENDATION_LIST_RESPONSE_FORMAT, parse_recommendation_list
+
+
+class BackgroundLoop:
+    """An asyncio event loop running in a daemon thread.
+
+    Async clients are bound to the loop they were first used on, so a single
+    long-lived loop lets one backend (and its connection pool) be shared by
+    every Streamlit session instead of being rebuilt per rerun.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="section-generation", daemon=True)
+        self._thread.start()
+
+    def submit(self, coroutine):
+        """Schedules a coroutine on the loop and returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+async def generate_section(backend, section, conversation_history, model):
+    """Requests one section; returns a string for prose sections or a list of Recommendations"""
+    system_prompt, max_tokens = SECTION_PROMPTS[section]
+    request = {}
+    if section in CARD_SECTIONS:
+        request["response_format"] = RECOMMENDATION_LIST_RESPONSE_FORMAT
+    content = await backend.achat(
+        build_recommendations_messages(conversation_history, system_prompt),
+        model,
+        max_tokens=max_tokens,
+        **request
+    )
+    if section in CARD_SECTIONS:
+        return parse_recommendation_list(content)
+    return content.strip()
+
+
+async def generate_sections(backend, conversation_history, model, on_result, sections=tuple(SECTION_PROMPTS)):
+    """Generates every section concurrently, calling on_result(section, value, error) as each finishes.
+
+    A failing section reports its exception through on_result and does not
+    cancel the others.
+    """
+    async def run(section):
+        try:
+            value = await generate_section(backend, section, conversation_history, model)
+        except Exception as error:
+            on_result(section, None, error)
+        else:
+            on_result(section, value, None)
+
+    await asyncio.gather(*(run(section) for section in sections))
+
+
+def iter_sections(background_loop, backend, conversation_history, model, sections=tuple(SECTION_PROMPTS)):
+    """Yields (section, value, error) in completion order from the calling thread"""
+    results = queue.Queue()
+    future = background_loop.submit(generate_sections(
+        backend, conversation_history, model,
+        lambda section, value, error: results.put((section, value, error)),
+        sections,
+    ))
+    for _ in sections:
+        yield results.get()
+    future.result()
@@ -0,0 +1,241 @@
+"""Cross-session cache that reuses recommendations for similar setup profiles"""
+
+import hashlib
+import math
+import threading
+import time
+from collections import defaultdict
+
+from catalogue import normalize_title, split_list
+from genres import find_genres, normalize_genre
+
+
+# The chat only refines the setup answers, so it carries half the weight of the profile in a match's score
+CHAT_WEIGHT = 0.5
+
+
+def _normalized(vector):
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+
+def chat_mentions(messages, catalogue=None):
+    """Coarse summary of what the user asked for in chat: the genres and, with a catalogue, the titles they named.
+
+    Exact wording varies too much between users to compare, while the
+    genres and shows they bring up are what actually changes the page.
+    """
+    text = "\n".join(message["content"] for message in messages if message["role"] == "user")
+    mentions = {f"genre:{genre}" for genre in find_genres(text) if genre != "default"}
+    if catalogue is not None:
+        mentions |= {f"title:{normalize_title(title)}" for title in catalogue.find_titles(text)}
+    return mentions
+
+
+def profile_fingerprint(profile, messages=(), favorite_titles=None, model="", catalogue=None):
+    """Returns (bucket, vector) describing a setup profile and its chat.
+
+    The bucket holds the choices that must match exactly (model, experience
+    level, content type and length). The vector holds two parts, each
+    normalized on its own: favourite titles and genres, and the chat
+    mentions from chat_mentions() under "chat:" terms. SemanticCache scores
+    the parts separately. Pass favorite_titles (for example canonical
+    catalogue titles, plus the raw names of favourites the catalogue does
+    not know) to override the free-form favourites text.
+    """
+    bucket = (model, profile.get("experience_level", ""), profile.get("content_type", ""),
+              profile.get("content_length", ""))
+    if favorite_titles is None:
+        favorite_titles = split_list(profile.get("favorite_anime", ""))
+    profile_vector = {}
+    for title in favorite_titles:
+        name = normalize_title(title)
+        if name:
+            profile_vector[f"title:{name}"] = 1.0
+    for part in split_list(profile.get("favorite_genres", "")):
+        part = " ".join(part.lower().split())
+        genre = normalize_genre(part)
+        profile_vector[f"genre:{genre if genre != 'default' else part}"] = 1.0
+    vector = _normalized(profile_vector)
+    for term, weight in _normalized(dict.fromkeys(chat_mentions(messages, catalogue), 1.0)).items():
+        vector[f"chat:{term}"] = weight
+    return bucket, vector
+
+
+def _is_chat_term(term):
+    return term.startswith("chat:")
+
+
+def personalize_page(page, profile, exclude_titles, catalogue=None):
+    """Adapts a page generated for another user with a similar profile.
+
+    The theme and each card's appeal were written to the other user, often
+    by name and about what they said in chat, so they are replaced with
+    text built from this profile. Recommendations for titles this user
+    already named are dropped; with a catalogue, titles are compared by
+    their canonical entry so aliases and punctuation variants match too.
+    """
+    def canonical(title):
+        entry = catalogue.lookup(title) if catalogue is not None else None
+        return normalize_title(entry.title if entry is not None else title)
+
+    excluded = {canonical(title) for title in exclude_titles}
+    page.top_recommendations = [r for r in page.top_recommendations if canonical(r.title) not in excluded]
+    page.hidden_gems = [r for r in page.hidden_gems if canonical(r.title) not in excluded]
+
+    genres = ", ".join(split_list(profile.get("favorite_genres", ""))).lower()
+    favorites = ", ".join(exclude_titles) or profile.get("favorite_anime", "")
+    username = profile.get("username") or "you"
+    theme = f"Picks for {username}"
+    if genres:
+        theme += f", built around your love of {genres}"
+    if favorites:
+        theme += f" and close in spirit to {favorites}"
+    page.overall_theme = theme + "."
+    for recommendation in page.top_recommendations + page.hidden_gems:
+        taste = recommendation.genre.lower() or genres
+        recommendation.appeal = (f"A strong match for your taste in {taste}." if taste
+                                 else "A strong match for the stories you told us you enjoy.")
+    return page
+
+
+class _Entry:
+    __slots__ = ("bucket", "vector", "value", "created_at", "last_used", "uses")
+
+    def __init__(self, bucket, vector, value, now):
+        self.bucket = bucket
+        self.vector = vector
+        self.value = value
+        self.created_at = now
+        self.last_used = now
+        self.uses = 0
+
+
+class SemanticCache:
+    """Bounded nearest-neighbour cache over profile fingerprints.
+
+    An identical fingerprint is found with one dict lookup. Otherwise the
+    entries sharing a term with the query (via an inverted index per bucket)
+    are scored by cosine similarity of the setup part and of the chat part
+    separately. A match needs at least threshold on the setup. When both
+    chats mention genres or titles they must also reach chat_threshold, so
+    identical setup answers cannot carry a conversation asking for
+    something else; a chat without mentions does not veto a match. The
+    best match by combined score (the chat at CHAT_WEIGHT) is returned.
+    When full, the least frequently used entry is evicted
+    ("lfu", ties go to the least recently used) or simply the least
+    recently used ("lru"). Eviction scans every entry, which costs little
+    next to the model call that a miss implies.
+    """
+
+    def __init__(self, max_entries=512, threshold=0.75, chat_threshold=0.5, ttl_seconds=None, policy="lfu"):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.chat_threshold = chat_threshold
+        self.ttl_seconds = ttl_seconds
+        self.policy = policy
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}
+        self._postings = defaultdict(set)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(bucket, vector):
+        digest = hashlib.sha256(repr(bucket).encode("utf-8"))
+        for term in sorted(vector):
+            digest.update(f"\x00{term}={vector[term]:.6f}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds is not None and now - entry.created_at > self.ttl_seconds
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for term in entry.vector:
+            postings = self._postings[(entry.bucket, term)]
+            postings.discard(key)
+            if not postings:
+                del self._postings[(entry.bucket, term)]
+
+    def lookup(self, bucket, vector):
+        """Returns (value, similarity) for the closest cached profile, or (None, 0.0) on a miss"""
+        now = time.time()
+        with self._lock:
+            key = self._key(bucket, vector)
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry, now):
+                self.exact_hits += 1
+                return self._use(entry, now), 1.0
+
+            setup_scores = defaultdict(float)
+            chat_scores = defaultdict(float)
+            for term, weight in vector.items():
+                scores = chat_scores if _is_chat_term(term) else setup_scores
+                for candidate in self._postings.get((bucket, term), ()):
+                    scores[candidate] += weight * self._entries[candidate].vector[term]
+            has_chat = any(map(_is_chat_term, vector))
+            matches = []
+            for candidate, setup_score in setup_scores.items():
+                if setup_score < self.threshold:
+                    continue
+                candidate_has_chat = any(map(_is_chat_term, self._entries[candidate].vector))
+                if has_chat and candidate_has_chat:
+                    chat_score = chat_scores.get(candidate, 0.0)
+                    if chat_score < self.chat_threshold:
+                        continue
+                else:
+                    # Nothing to compare, so the chat neither vetoes nor helps beyond an even match
+                    chat_score = 1.0 if has_chat == candidate_has_chat else self.chat_threshold
+                matches.append(((setup_score + CHAT_WEIGHT * chat_score) / (1 + CHAT_WEIGHT), candidate))
+            for score, candidate in sorted(matches, reverse=True):
+                entry = self._entries[candidate]
+                if self._expired(entry, now):
+                    self._remove(candidate)
+                    continue
+                self.near_hits += 1
+                return self._use(entry, now), score
+
+            self.misses += 1
+            return None, 0.0
+
+    def _use(self, entry, now):
+        entry.uses += 1
+        entry.last_used = now
+        return entry.value
+
+    def set(self, bucket, vector, value):
+        """Caches value for a profile fingerprint"""
+        if self.max_entries <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            key = self._key(bucket, vector)
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_entries:
+                if self.policy == "lru":
+                    victim = min(self._entries, key=lambda k: self._entries[k].last_used)
+                else:
+                    victim = min(self._entries, key=lambda k: (self._entries[k].uses, self._entries[k].last_used))
+                self._remove(victim)
+                self.evictions += 1
+            self._entries[key] = _Entry(bucket, vector, value, now)
+            for term in vector:
+                self._postings[(bucket, term)].add(key)
+
+    def stats(self):
+        """Returns hit/miss counters for display or logging"""
+        with self._lock:
+            hits = self.exact_hits + self.near_hits
+            total = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+            }
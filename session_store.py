@@ -0,0 +1,125 @@
+"""SQLite-backed store that lets any app replica resume a session from its URL token"""
+
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from dataclasses import asdict
+
+from recommendations import Recommendation, recommendation_from_dict
+
+
+def new_session_token():
+    """Creates an unguessable token for the session URL"""
+    return secrets.token_urlsafe(16)
+
+
+def _dump_events(events):
+    # Same shape as the NDJSON recommendation lines: cards carry their fields, prose carries "text"
+    return json.dumps([{"section": section, **asdict(value)} if isinstance(value, Recommendation)
+                       else {"section": section, "text": value} for section, value in events], ensure_ascii=False)
+
+
+def _load_events(text):
+    events = []
+    for item in json.loads(text):
+        if "text" in item:
+            events.append((item["section"], item["text"]))
+        else:
+            recommendation = recommendation_from_dict(item)
+            if recommendation is not None:
+                events.append((item["section"], recommendation))
+    return events
+
+
+class SessionStore:
+    """Conversations, setup answers and finished recommendation pages keyed by session token.
+
+    The database runs in WAL mode, so several app processes can share one
+    file: readers never block the writer and each write is a short
+    transaction. Messages are appended row by row as the chat grows rather
+    than rewriting the whole conversation.
+    """
+
+    def __init__(self, db_path, ttl_seconds=7 * 24 * 3600):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=10.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "token TEXT PRIMARY KEY, state TEXT NOT NULL, recommendations TEXT, updated_at REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "token TEXT NOT NULL, position INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+            "PRIMARY KEY (token, position));"
+        )
+        self.prune()
+
+    def load(self, token):
+        """Returns (state, recommendation events or None, message count), or None for an unknown token"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state, recommendations, updated_at FROM sessions WHERE token = ?", (token,)
+            ).fetchone()
+            if row is None or self._expired(row[2]):
+                return None
+            count = self._db.execute("SELECT COUNT(*) FROM messages WHERE token = ?", (token,)).fetchone()[0]
+        return json.loads(row[0]), _load_events(row[1]) if row[1] else None, count
+
+    def load_messages(self, token):
+        """Returns the session's messages in order"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT role, content FROM messages WHERE token = ? ORDER BY position", (token,)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def save_state(self, token, state):
+        """Stores the small state dict (setup answers and progress flags)"""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO sessions (token, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(token) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (token, json.dumps(state, ensure_ascii=False), time.time()),
+            )
+
+    def append_messages(self, token, start, messages):
+        """Adds messages starting at position start; positions already stored are left alone"""
+        if not messages:
+            return
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO messages (token, position, role, content) VALUES (?, ?, ?, ?)",
+                [(token, start + offset, message["role"], message["content"])
+                 for offset, message in enumerate(messages)],
+            )
+
+    def save_recommendations(self, token, events):
+        """Stores the rendered (section, value) events of a finished recommendations page"""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE sessions SET recommendations = ?, updated_at = ? WHERE token = ?",
+                (_dump_events(events), time.time(), token),
+            )
+
+    def delete(self, token):
+        """Forgets a session"""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM messages WHERE token = ?", (token,))
+            self._db.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def prune(self):
+        """Deletes sessions idle for longer than the TTL"""
+        if self.ttl_seconds is None:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM messages WHERE token IN (SELECT token FROM sessions WHERE updated_at < ?)", (cutoff,)
+            )
+            self._db.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,))
+
+    def _expired(self, updated_at):
+        return self.ttl_seconds is not None and time.time() - updated_at > self.ttl_seconds
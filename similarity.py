@@ -0,0 +1,149 @@
+"""Vectorized TF-IDF similarity recommender over the offline catalogue"""
+
+import hashlib
+import json
+
+import numpy as np
+
+from catalogue import CONTENT_LENGTH_FILTERS, CONTENT_TYPE_FILTERS, CONTENT_TYPES, split_list
+from genres import normalize_genre
+
+
+# Stated genres count for more than genres inferred from favourite titles
+STATED_GENRE_WEIGHT = 2.0
+
+
+def _entry_terms(catalogue, entry_id):
+    return [f"genre:{genre}" for genre in catalogue.genres[entry_id] if genre != "default"] + \
+           [f"tag:{tag}" for tag in catalogue.tags[entry_id]]
+
+
+def build_tfidf_matrix(catalogue):
+    """Returns (matrix, vocabulary) with one L2-normalized float32 TF-IDF row per entry"""
+    rows = [_entry_terms(catalogue, entry_id) for entry_id in range(len(catalogue))]
+    vocabulary = sorted({term for terms in rows for term in terms})
+    columns = {term: index for index, term in enumerate(vocabulary)}
+    matrix = np.zeros((len(rows), len(vocabulary)), dtype=np.float32)
+    for entry_id, terms in enumerate(rows):
+        for term in terms:
+            matrix[entry_id, columns[term]] = 1.0
+    document_frequency = matrix.sum(axis=0)
+    idf = np.log((1 + len(rows)) / (1 + document_frequency)) + 1.0
+    matrix *= idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1.0, norms)
+    return matrix, vocabulary
+
+
+class SimilarityIndex:
+    """Scores every catalogue entry against a taste profile in one matrix-vector product.
+
+    The TF-IDF matrix is written next to the catalogue as a .npy file and
+    memory-mapped on later loads, so startup cost and resident memory stay
+    flat as the catalogue grows. Content type, length and popularity filters
+    are boolean masks over columns copied from the catalogue.
+    """
+
+    def __init__(self, catalogue, matrix, vocabulary):
+        self.catalogue = catalogue
+        self.matrix = matrix
+        self.vocabulary = vocabulary
+        self._columns = {term: index for index, term in enumerate(vocabulary)}
+        self.type_codes = np.frombuffer(catalogue.type_codes, dtype=np.uint8)
+        self.episodes = np.frombuffer(catalogue.episodes, dtype=np.uint16)
+        self.volumes = np.frombuffer(catalogue.volumes, dtype=np.uint16)
+        self.finished = np.frombuffer(catalogue.finished, dtype=np.uint8).astype(bool)
+        self.popularity = np.frombuffer(catalogue.popularity, dtype=np.uint8)
+
+    @classmethod
+    def build(cls, catalogue):
+        """Builds an in-memory index"""
+        matrix, vocabulary = build_tfidf_matrix(catalogue)
+        return cls(catalogue, matrix, vocabulary)
+
+    @classmethod
+    def load_or_build(cls, catalogue, path_prefix):
+        """Memory-maps a saved index, rebuilding it if it is missing or was built for another catalogue"""
+        matrix_path, meta_path = f"{path_prefix}.npy", f"{path_prefix}.json"
+        try:
+            with open(meta_path, encoding="utf-8") as handle:
+                meta = json.load(handle)
+            if meta["rows"] == len(catalogue) and meta["titles_hash"] == _titles_hash(catalogue):
+                return cls(catalogue, np.load(matrix_path, mmap_mode="r"), meta["vocabulary"])
+        except (OSError, ValueError, KeyError):
+            pass
+        index = cls.build(catalogue)
+        try:
+            np.save(matrix_path, index.matrix)
+            with open(meta_path, "w", encoding="utf-8") as handle:
+                json.dump({"rows": len(catalogue), "titles_hash": _titles_hash(catalogue),
+                           "vocabulary": index.vocabulary}, handle)
+        except OSError:
+            # Read-only deployments keep the in-memory index
+            pass
+        return index
+
+    def profile_vector(self, favorite_ids=(), favorite_genres=""):
+        """Builds a normalized taste vector from favourite entries and stated genres"""
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        if len(favorite_ids):
+            vector += np.asarray(self.matrix[np.asarray(sorted(favorite_ids))]).sum(axis=0)
+        for part in split_list(favorite_genres):
+            part = part.lower()
+            for term in (f"genre:{normalize_genre(part)}", f"tag:{part}"):
+                column = self._columns.get(term)
+                if column is not None:
+                    vector[column] += STATED_GENRE_WEIGHT
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def preference_mask(self, content_type="Both anime and manga", content_length="No preference",
+                        max_popularity=None):
+        """Boolean mask of entries allowed by the setup screen's choices"""
+        mask = np.ones(len(self.type_codes), dtype=bool)
+        allowed = CONTENT_TYPE_FILTERS.get(content_type)
+        if allowed is not None:
+            mask &= np.isin(self.type_codes, [CONTENT_TYPES.index(name) for name in allowed])
+        if content_length == "Completed series only":
+            mask &= self.finished
+        elif content_length in CONTENT_LENGTH_FILTERS:
+            (episodes_low, episodes_high), (volumes_low, volumes_high) = CONTENT_LENGTH_FILTERS[content_length]
+            is_movie = self.type_codes == CONTENT_TYPES.index("movie")
+            by_episodes = (self.episodes >= episodes_low) & (self.episodes <= episodes_high)
+            by_volumes = (self.volumes >= volumes_low) & (self.volumes <= volumes_high)
+            unknown = (self.episodes == 0) & (self.volumes == 0)
+            fits = np.where(self.episodes > 0, by_episodes, by_volumes | unknown)
+            mask &= np.where(is_movie, content_length.startswith("Short"), fits)
+        if max_popularity is not None:
+            mask &= self.popularity <= max_popularity
+        return mask
+
+    def top_k(self, profile, k=3, mask=None, exclude=()):
+        """Returns [(entry_id, score)] for the k best-scoring entries, best first"""
+        scores = self.matrix @ profile
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        if len(exclude):
+            scores[np.asarray(list(exclude))] = -np.inf
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        ordered = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(entry_id), float(scores[entry_id])) for entry_id in ordered]
+
+    def hidden_gems(self, favorite_anime="", favorite_genres="", content_type="Both anime and manga",
+                    content_length="No preference", k=3, max_popularity=2):
+        """Finds lesser-known entries closest to a setup profile without calling the model"""
+        favorites = {entry.id for entry in self.catalogue.resolve_favorites(favorite_anime)}
+        profile = self.profile_vector(favorites, favorite_genres)
+        if not profile.any():
+            return []
+        mask = self.preference_mask(content_type, content_length, max_popularity)
+        return [self.catalogue.entry(entry_id) for entry_id, score in self.top_k(profile, k, mask, favorites)
+                if score > 0]
+
+
+def _titles_hash(catalogue):
+    # Fingerprint so a saved matrix is never paired with a different catalogue
+    return hashlib.sha1("\x00".join(catalogue.titles).encode("utf-8")).hexdigest()
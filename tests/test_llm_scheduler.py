@@ -0,0 +1,164 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+openai = pytest.importorskip("openai")
+httpx = pytest.importorskip("httpx")
+
+from llm_backend import LLMBackend  # noqa: E402
+from llm_scheduler import ModelBusyError, RequestScheduler, ScheduledBackend, TokenBucket  # noqa: E402
+
+
+MESSAGES = [{"role": "user", "content": "Recommend something"}]
+
+
+def rate_limit_error():
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return openai.RateLimitError("rate limited", response=httpx.Response(429, request=request), body=None)
+
+
+class Interrupted(BaseException):
+    """Stands in for Streamlit's RerunException and StopException"""
+
+
+class RecordingBackend(LLMBackend):
+    """Returns canned text, failing the first `failures` calls, and tracks how many calls overlap"""
+
+    def __init__(self, failures=0, seconds=0.0):
+        self.failures = failures
+        self.seconds = seconds
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def _enter(self, **call):
+        with self._lock:
+            self.calls.append(call)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            failing = len(self.calls) <= self.failures
+        return failing
+
+    def _exit(self):
+        with self._lock:
+            self.active -= 1
+
+    def chat(self, messages, model, on_usage=None, **options):
+        failing = self._enter(**options)
+        try:
+            time.sleep(self.seconds)
+            if failing:
+                raise rate_limit_error()
+            return "text"
+        finally:
+            self._exit()
+
+    def stream_chat(self, messages, model, on_usage=None, **options):
+        yield self.chat(messages, model, on_usage=on_usage, **options)
+
+    def structured(self, messages, model, response_format, on_usage=None, **options):
+        return self.chat(messages, model, on_usage=on_usage, response_format=response_format, **options)
+
+    async def achat(self, messages, model, on_usage=None, **options):
+        failing = self._enter(**options)
+        try:
+            await asyncio.sleep(self.seconds)
+            if failing:
+                raise rate_limit_error()
+            return "text"
+        finally:
+            self._exit()
+
+
+def scheduler(**settings):
+    return RequestScheduler(**{"base_delay": 0.01, "max_delay": 0.05, "seed": 1, **settings})
+
+
+def test_structured_passes_response_format_once():
+    backend = RecordingBackend()
+    response_format = {"type": "json_object"}
+    result = ScheduledBackend(backend, scheduler()).structured(MESSAGES, "gpt-4o", response_format, max_tokens=10)
+    assert result == "text"
+    assert backend.calls == [{"response_format": response_format, "max_tokens": 10}]
+
+
+def test_concurrency_is_capped():
+    backend = RecordingBackend(seconds=0.05)
+    shared = scheduler(max_concurrency=2)
+    threads = [threading.Thread(target=ScheduledBackend(backend, shared).chat,
+                                args=([{"role": "user", "content": str(index)}], "gpt-4o"))
+               for index in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.max_active == 2
+    assert shared.stats()["active"] == 0
+    assert shared.stats()["admitted"] == 6
+
+
+def test_rate_limit_is_retried_then_succeeds():
+    shared = scheduler()
+    assert ScheduledBackend(RecordingBackend(failures=2), shared).chat(MESSAGES, "gpt-4o") == "text"
+    assert shared.stats()["retries"] == 2
+    assert shared.stats()["active"] == 0
+
+
+def test_gives_up_after_max_retries():
+    shared = scheduler(max_retries=1)
+    with pytest.raises(ModelBusyError):
+        ScheduledBackend(RecordingBackend(failures=5), shared).chat(MESSAGES, "gpt-4o")
+    assert shared.stats()["failures"] == 1
+    assert shared.stats()["active"] == 0
+
+
+def test_interrupted_rate_limit_wait_releases_the_slot():
+    shared = scheduler(max_concurrency=1, requests_per_minute=1)
+
+    def on_wait(position, eta):
+        if position == 0:
+            raise Interrupted()
+
+    backend = RecordingBackend()
+    # The first request uses the minute's budget, so the next two wait for rate limits and are interrupted
+    ScheduledBackend(backend, shared).chat(MESSAGES, "gpt-4o")
+    for index in range(2):
+        with pytest.raises(Interrupted):
+            ScheduledBackend(backend, shared, on_wait).chat([{"role": "user", "content": str(index)}], "gpt-4o")
+    assert shared.stats()["active"] == 0
+
+
+def test_cancelled_async_rate_limit_wait_releases_the_slot():
+    shared = scheduler(max_concurrency=1, requests_per_minute=1)
+    scheduled = ScheduledBackend(RecordingBackend(), shared)
+
+    async def run():
+        await scheduled.achat(MESSAGES, "gpt-4o")
+        task = asyncio.ensure_future(scheduled.achat([{"role": "user", "content": "again"}], "gpt-4o"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert shared.stats()["active"] == 0
+
+
+def test_async_followers_share_a_retried_leader():
+    backend = RecordingBackend(failures=1, seconds=0.05)
+    scheduled = ScheduledBackend(backend, scheduler(max_concurrency=1))
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(*(scheduled.achat(MESSAGES, "gpt-4o") for _ in range(40))), 5)
+
+    assert asyncio.run(run()) == ["text"] * 40
+    assert len(backend.calls) == 2
+
+
+def test_token_bucket_reports_the_wait_for_an_overdraft():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.reserve(60) == 0.0
+    assert bucket.reserve(30) == pytest.approx(30.0, abs=0.1)
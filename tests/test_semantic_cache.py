@@ -0,0 +1,76 @@
+import pytest
+
+from catalogue import Catalogue
+from recommendations import Recommendation, RecommendationPage
+from semantic_cache import SemanticCache, personalize_page, profile_fingerprint
+
+
+PROFILE = {
+    "username": "Bob",
+    "favorite_anime": "Naruto, One Piece",
+    "favorite_genres": "shonen",
+    "experience_level": "Beginner",
+    "content_type": "Anime only",
+    "content_length": "No preference",
+}
+
+
+@pytest.fixture(scope="module")
+def catalogue():
+    return Catalogue.load()
+
+
+def chat(*messages):
+    return [{"role": "user", "content": message} for message in messages]
+
+
+def fingerprint(catalogue, messages, profile=PROFILE):
+    favorites = [entry.title if entry is not None else name
+                 for name, entry in catalogue.match_favorites(profile["favorite_anime"])]
+    return profile_fingerprint(profile, messages, favorites, "gpt-4o", catalogue)
+
+
+def test_similar_chats_in_different_words_hit(catalogue):
+    cache = SemanticCache()
+    cache.set(*fingerprint(catalogue, chat("I'd love something dark and psychological, maybe horror")), "PAGE")
+    value, score = cache.lookup(*fingerprint(catalogue, chat("Give me a creepy psychological thriller",
+                                                             "Something disturbing, horror or a mystery is great")))
+    assert value == "PAGE"
+    assert score < 1.0
+
+
+def test_chat_without_mentions_does_not_veto(catalogue):
+    cache = SemanticCache()
+    cache.set(*fingerprint(catalogue, chat("I want a cozy romance")), "PAGE")
+    value, _ = cache.lookup(*fingerprint(catalogue, chat("Not sure, whatever you think")))
+    assert value == "PAGE"
+
+
+def test_same_setup_with_a_different_chat_misses(catalogue):
+    cache = SemanticCache()
+    cache.set(*fingerprint(catalogue, chat("I want dark psychological horror")), "PAGE")
+    assert cache.lookup(*fingerprint(catalogue, chat("I want a cozy romance, slice of life"))) == (None, 0.0)
+
+
+def test_uncatalogued_favourites_are_part_of_the_fingerprint(catalogue):
+    cache = SemanticCache()
+    cache.set(*fingerprint(catalogue, (), dict(PROFILE, favorite_anime="Naruto, Hellsing Ultimate")), "PAGE")
+    assert cache.lookup(*fingerprint(catalogue, (), dict(PROFILE, favorite_anime="Naruto, Baki"))) == (None, 0.0)
+
+
+def test_other_setup_answers_miss(catalogue):
+    cache = SemanticCache()
+    cache.set(*fingerprint(catalogue, ()), "PAGE")
+    assert cache.lookup(*fingerprint(catalogue, (), dict(PROFILE, content_type="Manga only"))) == (None, 0.0)
+
+
+def test_personalize_page_replaces_prose_and_drops_favourites(catalogue):
+    page = RecommendationPage(
+        overall_theme="Alice, you said you love horror",
+        top_recommendations=[Recommendation("Baki", appeal="Alice will love it"),
+                             Recommendation("Bleach", genre="Action", appeal="Alice will love it")],
+    )
+    page = personalize_page(page, PROFILE, ["Naruto", "Baki"], catalogue)
+    assert [r.title for r in page.top_recommendations] == ["Bleach"]
+    assert "Alice" not in page.overall_theme and "Bob" in page.overall_theme
+    assert "Alice" not in page.top_recommendations[0].appeal